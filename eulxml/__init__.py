@@ -16,8 +16,17 @@
 #   limitations under the License.
 
 import os
-import pkg_resources
+import sys
 
+# importlib.resources.files is only available in python 3.9+
+try:
+    from importlib.resources import files as _resource_files
+except ImportError:
+    _resource_files = None
+
+# NOTE: version is defined here rather than read from installed package
+# metadata, since setup.py uses it before eulxml is installed, and
+# importlib.metadata would add noticeably to the cost of importing eulxml
 __version_info__ = (1, 1, 3, None)
 
 # Dot-connect all but the last. Last is dash-connected if not None.
@@ -34,24 +43,64 @@ if __version_info__[-1] is not None:
 #: relative path for schema data directory
 SCHEMA_DATA_DIR = 'schema_data'
 
-# use package resources if possible, so this will work from an egg
-# http://peak.telecommunity.com/DevCenter/PythonEggs#accessing-package-resources
-if pkg_resources.resource_isdir(__name__, SCHEMA_DATA_DIR):
-    XMLCATALOG_DIR = pkg_resources.resource_filename(__name__,
-                                                     SCHEMA_DATA_DIR)
-    XMLCATALOG_FILE = pkg_resources.\
-        resource_filename(__name__,
-                          '%s/catalog.xml' % SCHEMA_DATA_DIR)
-else:
-    XMLCATALOG_DIR = os.path.join(os.path.dirname(__file__),
-                                  SCHEMA_DATA_DIR)
-    XMLCATALOG_FILE = os.path.join(XMLCATALOG_DIR, 'catalog.xml')
-
-# Add local XML catalog file to the environment variable so
-# it will automatically be used by libxml to resolve URIs.
-# See http://xmlsoft.org/catalog.html for more details.
-# Only add once, even if eulxml is loaded multiple times.
-if XMLCATALOG_FILE not in os.environ.get('XML_CATALOG_FILES', ''):
-    os.environ['XML_CATALOG_FILES'] = ":".join(
-        [path for path in (os.environ.get('XML_CATALOG_FILES'), XMLCATALOG_FILE)
-         if path])
+# Catalog paths are resolved, and the catalog registered with libxml,
+# on first use rather than at import time, so that code which never
+# loads schemas does not pay for it.  Use :func:`_ensure_catalog` (or
+# access XMLCATALOG_DIR / XMLCATALOG_FILE on this module) before any
+# parsing that may need to resolve schemas via the catalog.
+_CATALOG_PATHS = None
+_CATALOG_REGISTERED = False
+
+
+def _catalog_paths():
+    # determine the schema data directory and catalog file paths
+    global _CATALOG_PATHS
+    if _CATALOG_PATHS is None:
+        # use package resources if possible; importlib.resources avoids the
+        # startup cost of importing pkg_resources, which scans all of sys.path
+        catalog_dir = None
+        if _resource_files is not None:
+            schema_dir = _resource_files(__name__) / SCHEMA_DATA_DIR
+            # only usable if the resource is a real directory on the
+            # filesystem (e.g., not when loaded from a zipped egg)
+            if os.path.isdir(str(schema_dir)):
+                catalog_dir = str(schema_dir)
+
+        if catalog_dir is None:
+            catalog_dir = os.path.join(os.path.dirname(__file__),
+                                       SCHEMA_DATA_DIR)
+        _CATALOG_PATHS = (catalog_dir, os.path.join(catalog_dir, 'catalog.xml'))
+    return _CATALOG_PATHS
+
+
+def _ensure_catalog():
+    '''Add the local XML catalog file to the environment variable so
+    it will automatically be used by libxml to resolve URIs.
+    See http://xmlsoft.org/catalog.html for more details.
+    Only adds once, even if called or eulxml is loaded multiple times.
+    Returns a tuple of XML catalog directory and file.'''
+    global _CATALOG_REGISTERED
+    catalog_dir, catalog_file = _catalog_paths()
+    if not _CATALOG_REGISTERED:
+        if catalog_file not in os.environ.get('XML_CATALOG_FILES', ''):
+            os.environ['XML_CATALOG_FILES'] = ":".join(
+                [path for path in (os.environ.get('XML_CATALOG_FILES'),
+                                   catalog_file)
+                 if path])
+        _CATALOG_REGISTERED = True
+    return catalog_dir, catalog_file
+
+
+def __getattr__(name):
+    # lazily resolve catalog paths on first access (PEP 562)
+    if name == 'XMLCATALOG_DIR':
+        return _ensure_catalog()[0]
+    if name == 'XMLCATALOG_FILE':
+        return _ensure_catalog()[1]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+# module-level __getattr__ is only supported in python 3.7+;
+# resolve catalog paths at import time for older versions
+if sys.version_info < (3, 7):
+    XMLCATALOG_DIR, XMLCATALOG_FILE = _ensure_catalog()
@@ -28,19 +28,23 @@ For more information about setting up and testing XML catalogs, see the
 `libxml2 documentation <http://xmlsoft.org/catalog.html>`_.
 '''
 
+from contextlib import closing
 import os
+import hashlib
+import json
 import logging
-from datetime import date
+import threading
+import time
 from lxml import etree
 import sys
 
-from eulxml import xmlmap, __version__, XMLCATALOG_DIR, XMLCATALOG_FILE
+import eulxml
+from eulxml import xmlmap, __version__
 
-# requests is an optional dependency, handle gracefully if not present
-try:
-    import requests
-except ImportError:
-    requests = None
+# requests is an optional dependency, and is relatively slow to import;
+# it is only loaded (by _load_requests) when schemas are downloaded,
+# since this module is also used to resolve schemas from the catalog
+requests = None
 
 
 logger = logging.getLogger(__name__)
@@ -63,11 +67,57 @@ XSD_SCHEMAS = [
 ]
 # , 'http://www.archives.ncdcr.gov/mail-account.xsd'
 
+#: name of the manifest file, stored alongside downloaded schemas, which
+#: records when each schema was downloaded and the HTTP cache headers
+#: used to avoid downloading unchanged schemas again
+MANIFEST_FILE = 'MANIFEST.json'
+
+# file extensions for xml files saved in the catalog directory
+_XML_SUFFIXES = ('.xml', '.xsd')
+
+#: maximum age in seconds of local schema copies before
+#: :meth:`generate_catalog` checks for updates (30 days)
+CATALOG_MAX_AGE = 30 * 24 * 60 * 60
+
+#: size of chunks to read and write when downloading schemas
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+#: timeout in seconds for schema download requests
+DOWNLOAD_TIMEOUT = 30
+
+#: maximum number of schemas to download at the same time
+DOWNLOAD_THREADS = 8
+
+# shared requests session, so connections to the same host can be
+# reused across schema downloads; initialized by _get_session
+_session = None
+_session_lock = threading.Lock()
+
+# lock for updating the manifest file from concurrent downloads
+_manifest_lock = threading.Lock()
+
+# parsed catalogs, as a dictionary of catalog file -> {schema uri: local path}
+_catalog_cache = {}
+# lock for loading a catalog into the cache
+_catalog_lock = threading.Lock()
+
+# os.replace is not available on python 2; rename is atomic on posix
+_replace = getattr(os, 'replace', os.rename)
+
+
+#: XML catalog namespace
+CATALOG_NS = 'urn:oasis:names:tc:entity:xmlns:xml:catalog'
+
+# namespaced tag names and compiled xpath for catalog elements
+_CATALOG_TAG = '{%s}catalog' % CATALOG_NS
+_URI_TAG = '{%s}uri' % CATALOG_NS
+_URI_XPATH = etree.XPath('c:uri', namespaces={'c': CATALOG_NS})
+
 
 class Uri(xmlmap.XmlObject):
     """:class:`xmlmap.XmlObject` class for Catalog URIs"""
     ROOT_NAME = 'uri'
-    ROOT_NS = "urn:oasis:names:tc:entity:xmlns:xml:catalog"
+    ROOT_NS = CATALOG_NS
     #: name, i.e. schema URI
     name = xmlmap.StringField('@name')
     #: uri, i.e. path to load the schema locally
@@ -75,114 +125,454 @@ class Uri(xmlmap.XmlObject):
 
 
 class Catalog(xmlmap.XmlObject):
-    """:class:`xmlmap.XmlObject` class to for generating XML Catalogs"""
+    """:class:`xmlmap.XmlObject` class for reading XML Catalogs"""
     ROOT_NAME = 'catalog'
-    ROOT_NS = "urn:oasis:names:tc:entity:xmlns:xml:catalog"
+    ROOT_NS = CATALOG_NS
     ROOT_NAMESPACES = {'c': ROOT_NS}
     #: list of uris, as instance of :class:`Uri`
     uri_list = xmlmap.NodeListField('c:uri', Uri)
 
 
-def download_schema(uri, path, comment=None):
+def _load_catalog(catalog_file):
+    # parse a catalog file into a dictionary of schema uri -> local path;
+    # local paths in the catalog are relative to the catalog file
+    catalog_dir = os.path.dirname(catalog_file)
+    uris = {}
+    if os.path.exists(catalog_file):
+        tree = etree.parse(catalog_file)
+        for uri in _URI_XPATH(tree.getroot()):
+            uris[uri.get('name')] = os.path.join(catalog_dir, uri.get('uri'))
+    return uris
+
+
+def resolve(uri, catalog_file=None):
+    """Resolve a schema URI to the local copy saved in an XML catalog.
+
+    The catalog is parsed once and cached in memory, so repeated
+    lookups do not require loading the catalog file again.
+
+    :param uri: schema uri to resolve
+    :param catalog_file: optional catalog file; defaults to
+        :data:`eulxml.XMLCATALOG_FILE`
+    :returns: path to the local copy of the schema, or the original
+        uri if it is not in the catalog or the local copy is missing
+    """
+    if catalog_file is None:
+        catalog_file = eulxml.XMLCATALOG_FILE
+    uris = _catalog_cache.get(catalog_file)
+    if uris is None:
+        with _catalog_lock:
+            uris = _catalog_cache.get(catalog_file)
+            if uris is None:
+                uris = _catalog_cache[catalog_file] = \
+                    _load_catalog(catalog_file)
+    path = uris.get(uri)
+    if path is not None and os.path.exists(path):
+        return path
+    return uri
+
+
+class CatalogResolver(etree.Resolver):
+    """:class:`lxml.etree.Resolver` that loads documents listed in the
+    eulxml XML catalog from their local copies (see :meth:`resolve`).
+
+    This handles schemas imported or included by other schemas, and does
+    not depend on libxml picking up the catalog from the
+    **XML_CATALOG_FILES** environment variable.
+    """
+
+    def resolve(self, url, pubid, context):
+        path = resolve(url)
+        if path != url:
+            return self.resolve_filename(path, context)
+
+
+#: shared :class:`CatalogResolver` instance, used by :mod:`eulxml.xmlmap`
+#: parsers
+catalog_resolver = CatalogResolver()
+
+
+def _load_requests():
+    # import requests if it has not been loaded yet; returns false
+    # if requests is not available
+    global requests
+    if requests is None:
+        try:
+            import requests as requests_module
+        except ImportError:
+            return False
+        requests = requests_module
+    return True
+
+
+def _get_session():
+    # return the shared requests session, creating it on first use;
+    # retries transient server errors with backoff so one failed request
+    # does not drop a schema from the catalog
+    global _session
+    if _session is None:
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                retry = Retry(total=3, backoff_factor=0.5,
+                              status_forcelist=(500, 502, 503, 504),
+                              raise_on_status=False)
+                # keep enough connections per host for all download threads
+                adapter = HTTPAdapter(pool_connections=4,
+                                      pool_maxsize=DOWNLOAD_THREADS,
+                                      max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _load_manifest(manifest_path):
+    # load manifest details for previously downloaded schemas
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def _update_manifest(manifest_path, uri, entry):
+    # store manifest details for a schema, replacing the
+    # file atomically so a partial write is never read
+    with _manifest_lock:
+        manifest = _load_manifest(manifest_path)
+        manifest[uri] = entry
+        tmp_path = '%s.tmp' % manifest_path
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        _replace(tmp_path, manifest_path)
+
+
+def _schema_parser():
+    # parser for checking that schemas are well-formed; ids are not
+    # needed and large schemas (e.g. tei_all.xsd) should not be rejected
+    return etree.XMLParser(huge_tree=True, collect_ids=False)
+
+
+def download_schema(uri, path, comment=None, session=None, validate=False):
     """Download a schema from a specified URI and save it locally.
 
     :param uri: url where the schema should be downloaded
     :param path: local file path where the schema should be saved
     :param comment: optional comment; if specified, will be added to
         the downloaded schema
+    :param session: optional :class:`requests.Session` to use for the
+        download; by default, a session shared by all downloads is used
+        so that connections can be reused
+    :param validate: if true, parse the saved schema to check that it
+        is well-formed XML; off by default, since parsing large schemas
+        is expensive (see :meth:`verify_catalog`)
     :returns: true on success, false if there was an error and the
-        schema failed to download
+        schema failed to download (or is not well-formed, when
+        validating); an existing local copy is only replaced by a
+        complete, successful download
+
+    If the schema has been downloaded to the same path previously,
+    a conditional request is made using the cached ``ETag`` and
+    ``Last-Modified`` headers (stored in :data:`MANIFEST_FILE`), and the
+    local copy is left as is when the schema has not changed.  The
+    SHA-256 checksum of each downloaded schema is also recorded in the
+    manifest, so an unchanged schema is not rewritten even when the
+    server does not support conditional requests.
     """
     # if requests isn't available, warn and bail out
-    if requests is None:
+    if not _load_requests():
         sys.stderr.write(req_requests_msg)
         return
 
     # short-hand name of the schema, based on uri
     schema = os.path.basename(uri)
-    try:
+    if session is None:
+        session = _get_session()
+
+    # send cache headers from the last download, if the local copy
+    # is still present and was saved with the same comment
+    manifest_path = os.path.join(os.path.dirname(path), MANIFEST_FILE)
+    headers = {}
+    cached = _load_manifest(manifest_path).get(uri)
+    if cached and not (os.path.exists(path) and
+                       cached.get('comment') == comment):
+        cached = None
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
 
-        req = requests.get(uri, stream=True)
-        req.raise_for_status()
-        with open(path, 'wb') as schema_download:
-            for chunk in req.iter_content(chunk_size=1024):
-                if chunk: # filter out keep-alive new chunks
-                    schema_download.write(chunk)
-        # if a comment is specified, add it to the locally saved schema
-        if comment is not None:
-            tree = etree.parse(path)
-            tree.getroot().append(etree.Comment(comment))
-            with open(path, 'wb') as xml_catalog:
-                xml_catalog.write(etree.tostring(tree, pretty_print=True,
-                    xml_declaration=True, encoding="UTF-8"))
+    try:
+        # close the streamed response when done, so the connection is
+        # returned to the session pool even when returning early
+        with closing(session.get(uri, stream=True, headers=headers,
+                                 timeout=DOWNLOAD_TIMEOUT)) as req:
+            req.raise_for_status()
+            if req.status_code == 304:
+                logger.debug('Schema %s is unchanged', schema)
+                # update modification time to record that the copy is current
+                os.utime(path, None)
+                return True
+
+            # download to a temporary file and then move it into place, so
+            # an interrupted download never leaves a truncated schema behind
+            # and calculate a checksum of the schema content as it is saved
+            tmp_path = '%s.part' % path
+            sha256 = hashlib.sha256()
+            size = 0
+            try:
+                with open(tmp_path, 'wb') as schema_download:
+                    for chunk in req.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if chunk: # filter out keep-alive new chunks
+                            sha256.update(chunk)
+                            schema_download.write(chunk)
+                            size += len(chunk)
+
+                    # make sure the complete schema was received; content length
+                    # can only be compared if the content was not compressed
+                    expected_size = req.headers.get('Content-Length')
+                    if expected_size and \
+                            not req.headers.get('Content-Encoding') and \
+                            int(expected_size) != size:
+                        logger.warning('Incomplete download of schema %s ' +
+                                       '(%d of %s bytes)', schema, size,
+                                       expected_size)
+                        return False
+
+                    # if a comment is specified, add it to the locally saved
+                    # schema; a comment is allowed after the root element, so
+                    # it can be appended to the end of the file without parsing
+                    if comment is not None:
+                        schema_download.write(
+                            b'\n<!--' + comment.encode('utf-8') + b'-->\n')
+
+                if validate:
+                    try:
+                        etree.parse(tmp_path, _schema_parser())
+                    except etree.XMLSyntaxError as err:
+                        logger.warning('Downloaded schema %s is not well-formed: %s',
+                                       schema, err)
+                        return False
+
+                # leave an identical local copy as is
+                if cached and cached.get('sha256') == sha256.hexdigest():
+                    logger.debug('Schema %s is unchanged', schema)
+                    os.utime(path, None)
+                else:
+                    _replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
             logger.debug('Downloaded schema %s', schema)
 
-        return True
-
-    except requests.exceptions.HTTPError as err:
+            _update_manifest(manifest_path, uri, {
+                'etag': req.headers.get('ETag'),
+                'last_modified': req.headers.get('Last-Modified'),
+                'comment': comment,
+                'sha256': sha256.hexdigest(),
+                'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            })
+            return True
+
+    except requests.exceptions.RequestException as err:
+        # http errors, but also connection failures, timeouts, and
+        # exhausted retries; report them without aborting the caller
         msg = 'Failed to download schema %s' % schema
-        msg += '(error codes %s)' % err.response.status_code
-        logger.warn(msg)
+        if getattr(err, 'response', None) is not None:
+            msg += '(error codes %s)' % err.response.status_code
+        else:
+            msg += ' (%s)' % err
+        logger.warning(msg)
+
+        return False
 
+
+def _xml_files(xmlcatalog_dir):
+    # sorted list of paths for xml and xsd files in a catalog directory;
+    # scandir provides file type information without a separate stat
+    if hasattr(os, 'scandir'):
+        paths = [entry.path for entry in os.scandir(xmlcatalog_dir)
+                 if entry.name.endswith(_XML_SUFFIXES) and entry.is_file()]
+    else:
+        paths = [os.path.join(xmlcatalog_dir, filename)
+                 for filename in os.listdir(xmlcatalog_dir)
+                 if filename.endswith(_XML_SUFFIXES)]
+    return sorted(paths)
+
+
+def _thread_map(func, items, max_workers=None):
+    # apply a function to each item using a thread pool, returning the
+    # results in the same order as the items.  concurrent.futures is only
+    # available in the standard library on python 3; without it, items
+    # are processed one at a time
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:
+        return [func(item) for item in items]
+
+    if max_workers is not None:
+        max_workers = max(min(len(items), max_workers), 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
+
+
+def _is_well_formed(path):
+    # check that a file can be parsed; parsers are not thread-safe,
+    # so a new parser is used for each file
+    try:
+        etree.parse(path, _schema_parser())
+        return True
+    except etree.XMLSyntaxError as err:
+        logger.warning('Failed to parse %s: %s', os.path.basename(path), err)
         return False
 
 
-def generate_catalog(xsd_schemas=None, xmlcatalog_dir=None, xmlcatalog_file=None):
+def verify_catalog(xmlcatalog_dir=None):
+    """Check that the XML catalog and the schemas saved with it are
+    well-formed XML, e.g. as part of a continuous integration build.
+    Files are parsed in parallel, since lxml releases the GIL while
+    parsing.
+
+    :param xmlcatalog_dir: catalog directory to check; defaults to
+        :data:`eulxml.XMLCATALOG_DIR`
+    :returns: list of files that could not be parsed; an empty list
+        means all files are well-formed
+    """
+    if xmlcatalog_dir is None:
+        xmlcatalog_dir = eulxml.XMLCATALOG_DIR
+
+    paths = _xml_files(xmlcatalog_dir)
+    well_formed = _thread_map(_is_well_formed, paths)
+    return [path for path, ok in zip(paths, well_formed) if not ok]
+
+
+def _download_schemas(targets, comment=None):
+    # download schemas, given as a list of (uri, filename, local path)
+    # tuples, using a thread pool and a shared session so connections
+    # can be reused.  Returns a dictionary of schema uri -> download success.
+    session = _get_session()
+
+    def download(target):
+        schema_uri, filename, schema_path = target
+        # an unexpected error for one schema should not discard the
+        # results of the others or prevent the catalog from being written
+        try:
+            return download_schema(schema_uri, schema_path, comment,
+                                   session=session)
+        except Exception:
+            logger.exception('Error downloading schema %s', schema_uri)
+            return False
+
+    saved = _thread_map(download, targets, DOWNLOAD_THREADS)
+    return dict((target[0], success)
+                for target, success in zip(targets, saved))
+
+
+def _catalog_is_current(targets, xmlcatalog_file, max_age):
+    # check if the catalog exists and lists all the requested schemas,
+    # and local copies of all of them are present and recent enough
+    if not os.path.exists(xmlcatalog_file):
+        return False
+    catalog_uris = _load_catalog(xmlcatalog_file)
+    oldest = time.time() - max_age
+    for schema_uri, filename, schema_path in targets:
+        if schema_uri not in catalog_uris:
+            return False
+        try:
+            if os.stat(schema_path).st_mtime < oldest:
+                return False
+        except OSError:
+            # local copy is not present
+            return False
+    return True
+
+
+def generate_catalog(xsd_schemas=None, xmlcatalog_dir=None, xmlcatalog_file=None,
+                     force=False, max_age=None):
     """Generating an XML catalog for use in resolving schemas
 
     Creates the XML Catalog directory if it doesn't already exist.
     Uses :meth:`download_schema` to save local copies of schemas,
-    adding a comment indicating the date downloaded by eulxml.
+    adding a comment indicating they were downloaded by eulxml.
 
     Generates a new catalog.xml file, with entries for all schemas
     that downloaded successfully.  If no schemas downloaded, the catalog
     is not generated.
 
+    If the catalog already lists all of the schemas, and the local copies
+    are all present and newer than ``max_age`` seconds (by default,
+    :data:`CATALOG_MAX_AGE`), nothing is downloaded and the existing
+    catalog is returned, unless ``force`` is true.
+
     .. Note::
 
-        Currently this method overwites any existing schema and catalog
-        files, without checking if they are present or need to be
-        updated.
+        When the catalog is generated, existing schema files are only
+        downloaded again if the remote schema has changed (see
+        :meth:`download_schema`).
 
     """
     # if requests isn't available, warn and bail out
-    if requests is None:
+    if not _load_requests():
         sys.stderr.write(req_requests_msg)
         return
 
-    logger.debug("Generating a new XML catalog")
     if xsd_schemas is None:
         xsd_schemas = XSD_SCHEMAS
 
     if xmlcatalog_file is None:
-        xmlcatalog_file = XMLCATALOG_FILE
+        xmlcatalog_file = eulxml.XMLCATALOG_FILE
 
     if xmlcatalog_dir is None:
-        xmlcatalog_dir = XMLCATALOG_DIR
+        xmlcatalog_dir = eulxml.XMLCATALOG_DIR
+
+    # local filename and path for each schema, determined once
+    targets = []
+    for schema_uri in xsd_schemas:
+        filename = os.path.basename(schema_uri)
+        targets.append((schema_uri, filename,
+                        os.path.join(xmlcatalog_dir, filename)))
+
+    if max_age is None:
+        max_age = CATALOG_MAX_AGE
+    if not force and _catalog_is_current(targets, xmlcatalog_file, max_age):
+        logger.info('XML catalog %s is up to date', xmlcatalog_file)
+        return xmlmap.load_xmlobject_from_file(xmlcatalog_file, Catalog)
+
+    logger.debug("Generating a new XML catalog")
     # if the catalog dir doesn't exist, create it
     if not os.path.isdir(xmlcatalog_dir):
         os.mkdir(xmlcatalog_dir)
 
     # new xml catalog to be populated with saved schemas
-    catalog = Catalog()
+    catalog_root = etree.Element(_CATALOG_TAG,
+                                 nsmap={'c': CATALOG_NS})
 
-    # comment string to be added to locally-saved schemas
-    comment = 'Downloaded by eulxml %s on %s' % \
-        (__version__, date.today().isoformat())
+    # comment string to be added to locally-saved schemas; does not
+    # include the date, so that schema files only change when the
+    # schema does (download dates are recorded in the manifest)
+    comment = 'Downloaded by eulxml %s' % __version__
 
-    for schema_uri in xsd_schemas:
-        filename = os.path.basename(schema_uri)
-        schema_path = os.path.join(xmlcatalog_dir, filename)
-        saved = download_schema(schema_uri, schema_path, comment)
-        if saved:
+    # download all schemas, in parallel when possible
+    saved = _download_schemas(targets, comment)
+
+    # add successful downloads to the catalog, in the original order
+    for schema_uri, filename, schema_path in targets:
+        if saved.get(schema_uri):
             # if download succeeded, add to our catalog.
             # - name is the schema identifier (uri)
             # - uri is the local path to load
             # NOTE: using path relative to catalog file
-            catalog.uri_list.append(Uri(name=schema_uri, uri=filename))
+            etree.SubElement(catalog_root, _URI_TAG,
+                             uri=filename, name=schema_uri)
 
     # if we have any uris in our catalog, write it out
-    if catalog.uri_list:
-        with open(xmlcatalog_file, 'wb') as xml_catalog:
-            catalog.serializeDocument(xml_catalog, pretty=True)
-    return catalog
+    if len(catalog_root):
+        etree.ElementTree(catalog_root).write(xmlcatalog_file,
+            pretty_print=True, xml_declaration=True, encoding='UTF-8')
+        # clear any cached copy of the previous catalog
+        _catalog_cache.pop(xmlcatalog_file, None)
+    return Catalog(catalog_root)
@@ -18,8 +18,15 @@
 # this code borrows heavily from django.forms.models
 
 from __future__ import unicode_literals
-from collections import defaultdict
+import copy
+from io import StringIO
 from string import capwords
+import weakref
+try:
+    from functools import lru_cache
+except ImportError:
+    # not available in python 2
+    lru_cache = None
 
 from django.forms import BaseForm, CharField, IntegerField, BooleanField, \
         ChoiceField, Field, Form, DateField
@@ -34,12 +41,23 @@ import six
 from eulxml import xmlmap
 from eulxml.utils.compat import u
 
+try:
+    from sys import intern as _intern
+except ImportError:
+    # python 2 intern does not accept unicode field names; skip interning
+    _intern = lambda name: name
+
 def fieldname_to_label(name):
     """Default conversion from xmlmap Field variable name to Form field label:
     convert '_' to ' ' and capitalize words.  Should only be used when verbose_name
     is not set."""
     return capwords(name.replace('_', ' '))
 
+# labels are generated repeatedly for the same field names, every time a
+# form class or subform is created; cache them where possible
+if lru_cache is not None:
+    fieldname_to_label = lru_cache(maxsize=4096)(fieldname_to_label)
+
 
 def _parse_field_list(fieldnames, include_parents=False):
     """
@@ -53,25 +71,35 @@ def _parse_field_list(fieldnames, include_parents=False):
         subform fields implicitly include their parent fields in the parsed
         list.
     """
-    field_parts = (name.split('.') for name in fieldnames)
-    return _collect_fields(field_parts, include_parents)
-
-def _collect_fields(field_parts_list, include_parents):
-    """utility function to enable recursion in _parse_field_list()"""
+    # split each name once; recursion works on offsets into these tuples
+    field_parts = [tuple(_intern(part) for part in name.split('.'))
+                   for name in fieldnames]
+    return _collect_fields(field_parts, 0, include_parents)
+
+def _collect_fields(field_parts_list, depth, include_parents):
+    """utility function to enable recursion in _parse_field_list();
+    collects the field names at position ``depth`` in each tuple of name
+    parts"""
     fields = []
-    subpart_lists = defaultdict(list)
+    seen = set()        # for quick membership checks on fields
+    subpart_lists = {}
 
     for parts in field_parts_list:
-        field, subparts = parts[0], parts[1:]
-        if subparts:
-            if include_parents and field not in fields:
+        field = parts[depth]
+        if len(parts) > depth + 1:
+            if include_parents and field not in seen:
+                seen.add(field)
                 fields.append(field)
-            subpart_lists[field].append(subparts)
-        else:
+            subparts = subpart_lists.get(field)
+            if subparts is None:
+                subparts = subpart_lists[field] = []
+            subparts.append(parts)
+        elif field not in seen:
+            seen.add(field)
             fields.append(field)
 
-    subfields = dict((field, _collect_fields(subparts, include_parents))
-                     for field, subparts in six.iteritems(subpart_lists))
+    subfields = dict((field, _collect_fields(subparts, depth + 1, include_parents))
+                     for field, subparts in subpart_lists.items())
 
     return ParsedFieldList(fields, subfields)
 
@@ -79,9 +107,17 @@ class ParsedFieldList(object):
     """A parsed list of fields, used internally by :class:`XmlObjectForm`
     for tracking field and exclude lists."""
     def __init__(self, fields, subfields):
-        self.fields = fields
+        self.fields = tuple(fields)
+        # set of field names, for quick membership checks
+        self.fields_set = frozenset(fields)
         self.subfields = subfields
 
+    def _cache_key(self):
+        # hashable representation of the field list, for caching generated forms
+        return (self.fields,
+                tuple(sorted((name, sub._cache_key())
+                             for name, sub in self.subfields.items())))
+
 class SubformAwareModelFormOptions(ModelFormOptions):
     """A :class:`~django.forms.models.ModelFormOptions` subclass aware of
     fields and exclude lists, parsing them for later reference by
@@ -109,6 +145,130 @@ class SubformAwareModelFormOptions(ModelFormOptions):
             self.parsed_exclude = _parse_field_list(self.exclude, include_parents=False)
 
 
+# Handlers for generating form fields, subforms, and formsets based on
+# xmlmap field type.  Each handler takes the field name, xmlmap field,
+# form field keyword arguments, and a dictionary of form generation
+# settings, and returns a tuple of form field class, subform class,
+# formset class, and subform label (any of which may be None).
+
+def _formfield_handler(field_type):
+    # handler for xmlmap fields that map directly to a single form field
+    def handler(name, field, kwargs, context):
+        return field_type, None, None, None
+    return handler
+
+def _boolean_handler(name, field, kwargs, context):
+    # by default, fields are required - for a boolean, required means it must be checked
+    # since that seems nonsensical and not useful for a boolean,
+    # setting required to False to allow True or False values
+    kwargs['required'] = False
+    return BooleanField, None, None, None
+
+def _subform_label(name, kwargs):
+    return kwargs['label'] if 'label' in kwargs else fieldname_to_label(name)
+
+# generated subform classes, keyed on xmlobject node class and then on
+# the options used to generate them.  A generated form class refers to its
+# node class (as the Meta model), so the form classes are only referenced
+# weakly here; they are kept alive by the generated fields cached for the
+# parent models (see _formfields_cache), and both the form class and the
+# node class can be released once no model uses them.
+_subform_class_cache = weakref.WeakKeyDictionary()
+
+def _subform_class(name, field, form_label, context):
+    # if a subform class was declared, use that class exactly as is
+    if name in context['declared_subforms']:
+        return context['declared_subforms'][name]
+
+    # otherwise, define a new xmlobject form for the nodefield or
+    # nodelistfield class, using any options passed in for fields under this one
+    fieldlist = context['fieldlist']
+    excludelist = context['excludelist']
+    widgets = context['widgets']
+    subform_opts = {
+        'fields': fieldlist.subfields[name] if fieldlist and name in fieldlist.subfields else None,
+        'exclude': excludelist.subfields[name] if excludelist and name in excludelist.subfields else None,
+        'widgets': widgets[name] if widgets and name in widgets else None,
+        'label': form_label,
+    }
+
+    # reuse any subform class already generated for the same node class
+    # and options (e.g., the same node class used by several models)
+    try:
+        key = (subform_opts['fields']._cache_key() if subform_opts['fields'] else None,
+               subform_opts['exclude']._cache_key() if subform_opts['exclude'] else None,
+               tuple(sorted(subform_opts['widgets'].items())) if subform_opts['widgets'] else None,
+               form_label)
+        hash(key)
+    except (TypeError, AttributeError):
+        # unhashable options (e.g., nested widget dictionaries); don't cache
+        return xmlobjectform_factory(field.node_class, **subform_opts)
+
+    node_cache = _subform_class_cache.setdefault(field.node_class,
+                                                 weakref.WeakValueDictionary())
+    subform = node_cache.get(key)
+    if subform is None:
+        subform = node_cache[key] = xmlobjectform_factory(field.node_class,
+                                                          **subform_opts)
+    return subform
+
+def _nodefield_handler(name, field, kwargs, context):
+    form_label = _subform_label(name, kwargs)
+    return None, _subform_class(name, field, form_label, context), None, form_label
+
+def _nodelistfield_handler(name, field, kwargs, context):
+    form_label = _subform_label(name, kwargs)
+    subform = _subform_class(name, field, form_label, context)
+    # formset_factory is from django core and we link into it here.
+    formset = formset_factory(subform, formset=BaseXmlObjectFormSet,
+        max_num=subform._meta.max_num, can_delete=subform._meta.can_delete,
+        extra=subform._meta.extra, can_order=subform._meta.can_order)
+    formset.form_label = form_label
+    return None, None, formset, form_label
+
+def _listfield_formset(name, kwargs, listform):
+    # generate a listfield formset
+    formset = formset_factory(listform, formset=BaseXmlObjectListFieldFormSet)
+    # don't need can_delete: since each form is a single field, empty implies delete
+    # todo: extra, max_num ? widget?
+    formset.form_label = _subform_label(name, kwargs)
+    return formset
+
+def _stringlistfield_handler(name, field, kwargs, context):
+    return None, None, _listfield_formset(name, kwargs, ListFieldForm), None
+
+def _integerlistfield_handler(name, field, kwargs, context):
+    return None, None, _listfield_formset(name, kwargs, IntegerListFieldForm), None
+
+# datefield ? - not yet well-supported; leaving out for now
+# ... should probably distinguish between date and datetime field
+# TODO: other list variants
+
+# xmlmap field class -> handler; subclasses of supported field types
+# are added on first use (see :meth:`_field_handler`)
+_FIELD_HANDLERS = {
+    xmlmap.fields.StringField: _formfield_handler(CharField),
+    xmlmap.fields.IntegerField: _formfield_handler(IntegerField),
+    xmlmap.fields.DateField: _formfield_handler(DateField),
+    xmlmap.fields.SimpleBooleanField: _boolean_handler,
+    xmlmap.fields.NodeField: _nodefield_handler,
+    xmlmap.fields.NodeListField: _nodelistfield_handler,
+    xmlmap.fields.StringListField: _stringlistfield_handler,
+    xmlmap.fields.IntegerListField: _integerlistfield_handler,
+}
+
+def _field_handler(field):
+    # find the handler for an xmlmap field, or None if the type is unsupported
+    field_class = type(field)
+    handler = _FIELD_HANDLERS.get(field_class)
+    if handler is None:
+        for cls in field_class.__mro__[1:]:
+            handler = _FIELD_HANDLERS.get(cls)
+            if handler is not None:
+                _FIELD_HANDLERS[field_class] = handler
+                break
+    return handler
+
 
 def formfields_for_xmlobject(model, fields=None, exclude=None, widgets=None, options=None,
         declared_subforms=None, max_num=None, extra=None):
@@ -164,18 +324,26 @@ def formfields_for_xmlobject(model, fields=None, exclude=None, widgets=None, opt
     if max_num is None and options is not None:
         max_num = options.max_num
 
+    # settings needed by field handlers to generate subforms
+    context = {
+        'declared_subforms': declared_subforms or {},
+        'fieldlist': fieldlist,
+        'excludelist': excludelist,
+        'widgets': widgets,
+    }
+
     # collect the fields (unordered for now) that we're going to be returning
     formfields = {}
     subforms = {}
     formsets = {}
-    field_order = {}
+    field_order = []
     subform_labels = {}
 
-    for name, field in six.iteritems(model._fields):
-        if fieldlist and not name in fieldlist.fields:
+    for name, field in model._fields.items():
+        if fieldlist and not name in fieldlist.fields_set:
             # if specific fields have been requested and this is not one of them, skip it
             continue
-        if excludelist and name in excludelist.fields:
+        if excludelist and name in excludelist.fields_set:
             # if exclude has been specified and this field is listed, skip it
             continue
         if widgets and name in widgets:
@@ -204,116 +372,109 @@ def formfields_for_xmlobject(model, fields=None, exclude=None, widgets=None, opt
                 # TODO: add an empty_label option (like django ModelChoiceField)
                 # to xmlobjectform and pass it in to make this easier to customize
                 kwargs['choices'].insert(0, ('', ''))
-        elif isinstance(field, xmlmap.fields.StringField):
-            field_type = CharField
-        elif isinstance(field, xmlmap.fields.IntegerField):
-            field_type = IntegerField
-        elif isinstance(field, xmlmap.fields.DateField):
-            field_type = DateField
-        elif isinstance(field, xmlmap.fields.SimpleBooleanField):
-            # by default, fields are required - for a boolean, required means it must be checked
-            # since that seems nonsensical and not useful for a boolean,
-            # setting required to False to allow True or False values
-            kwargs['required'] = False
-            field_type = BooleanField
-
-        # datefield ? - not yet well-supported; leaving out for now
-        # ... should probably distinguish between date and datetime field
-
-        elif isinstance(field, xmlmap.fields.NodeField) or \
-            isinstance(field, xmlmap.fields.NodeListField):
-            form_label = kwargs['label'] if 'label' in kwargs else fieldname_to_label(name)
-            # store subform label in case we can't set on subform/formset
-            subform_labels[name] = form_label
-
-             # if a subform class was declared, use that class exactly as is
-            if name in declared_subforms:
-            	subform = declared_subforms[name]
-
-            # otherwise, define a new xmlobject form for the nodefield or
-            # nodelistfield class, using any options passed in for fields under this one
-            else:
-                subform_opts = {
-                    'fields': fieldlist.subfields[name] if fieldlist and name in fieldlist.subfields else None,
-                    'exclude': excludelist.subfields[name] if excludelist and name in excludelist.subfields else None,
-                    'widgets': widgets[name] if widgets and name in widgets else None,
-                    'label': form_label,
-                }
-
-                # create the subform class
-                subform = xmlobjectform_factory(field.node_class, **subform_opts)
-
-            # store subform or generate and store formset, depending on field type
-            if isinstance(field, xmlmap.fields.NodeField):
-                subforms[name] = subform
-            elif isinstance(field, xmlmap.fields.NodeListField):
-                # formset_factory is from django core and we link into it here.
-                formsets[name] = formset_factory(subform, formset=BaseXmlObjectFormSet,
-                    max_num=subform._meta.max_num, can_delete=subform._meta.can_delete,
-                    extra=subform._meta.extra, can_order=subform._meta.can_order)
-
-                formsets[name].form_label = form_label
-
-        elif isinstance(field, xmlmap.fields.StringListField) or \
-	    isinstance(field, xmlmap.fields.IntegerListField):
-            form_label = kwargs['label'] if 'label' in kwargs else fieldname_to_label(name)
-
-            if isinstance(field, xmlmap.fields.IntegerListField):
-            	listform = IntegerListFieldForm
-            else:
-            	listform = ListFieldForm
-
-            # generate a listfield formset
-            formsets[name] = formset_factory(listform, formset=BaseXmlObjectListFieldFormSet)
-            # don't need can_delete: since each form is a single field, empty implies delete
-            # todo: extra, max_num ? widget?
-            formsets[name].form_label = form_label
-
-        # TODO: other list variants
-
-
         else:
-            # raise exception for unsupported fields
-            # currently doesn't handle list fields
-            raise Exception('Error on field "%s": XmlObjectForm does not yet support auto form field generation for %s.' \
-            	% (name, field.__class__))
+            handler = _field_handler(field)
+            if handler is None:
+                # raise exception for unsupported fields
+                raise Exception('Error on field "%s": XmlObjectForm does not yet support auto form field generation for %s.' \
+                    % (name, field.__class__))
+
+            field_type, subform, formset, form_label = handler(name, field, kwargs, context)
+            if subform is not None:
+                subforms[name] = subform
+            if formset is not None:
+                formsets[name] = formset
+            if form_label is not None:
+                # store subform label in case we can't set on subform/formset
+                subform_labels[name] = form_label
 
         if field_type is not None:
             if 'label' not in kwargs:
                 kwargs['label'] = fieldname_to_label(name)
             formfields[name] = field_type(**kwargs)
 
-        # create a dictionary indexed by field creation order, for default field ordering
-        field_order[field.creation_counter] = name
+        # track field creation order, for default field ordering
+        field_order.append((field.creation_counter, name))
 
-    # if fields were explicitly specified, return them in that order
+    # if fields were explicitly specified, return them in that order;
+    # otherwise sort on field creation counter
     if fieldlist:
-        ordered_fields = SortedDict((name, formfields[name])
-                                    for name in fieldlist.fields
-                                    if name in formfields)
-        ordered_subforms = SortedDict((name, subforms[name])
-                                      for name in fieldlist.fields
-                                      if name in subforms)
-        ordered_formsets = SortedDict((name, formsets[name])
-                                      for name in fieldlist.fields
-                                      if name in formsets)
+        names = fieldlist.fields
     else:
-        # sort on field creation counter and generate a django sorted dictionary
-        ordered_fields = SortedDict(
-            [(field_order[key], formfields[field_order[key]]) for key in sorted(field_order.keys())
-                                                if field_order[key] in formfields ]
-        )
-        ordered_subforms = SortedDict(
-            [(field_order[key], subforms[field_order[key]]) for key in sorted(field_order.keys())
-                                                if field_order[key] in subforms ]
-        )
-        ordered_formsets = SortedDict(
-            [(field_order[key], formsets[field_order[key]]) for key in sorted(field_order.keys())
-                                                if field_order[key] in formsets ]
-        )
+        field_order.sort()
+        names = [name for counter, name in field_order]
+
+    ordered_fields = SortedDict()
+    ordered_subforms = SortedDict()
+    ordered_formsets = SortedDict()
+    for name in names:
+        if name in formfields:
+            ordered_fields[name] = formfields[name]
+        elif name in subforms:
+            ordered_subforms[name] = subforms[name]
+        elif name in formsets:
+            ordered_formsets[name] = formsets[name]
+
     return ordered_fields, ordered_subforms, ordered_formsets, subform_labels
 
 
+# generated form fields, subforms and formsets, keyed on xmlobject model
+# and then on the options used to generate them
+_formfields_cache = weakref.WeakKeyDictionary()
+
+def _cached_formfields_for_xmlobject(model, options, declared_subforms):
+    """Caching wrapper around :meth:`formfields_for_xmlobject`, used by
+    :class:`XmlObjectFormType` so that form classes declared with the
+    same model and options (including the subform classes generated for
+    every :class:`~eulxml.xmlmap.fields.NodeField`) only walk the model
+    fields once."""
+    parsed_fields = getattr(options, 'parsed_fields', None)
+    parsed_exclude = getattr(options, 'parsed_exclude', None)
+    try:
+        key = (parsed_fields._cache_key() if parsed_fields else None,
+               parsed_exclude._cache_key() if parsed_exclude else None,
+               tuple(sorted(options.widgets.items())) if options.widgets else None,
+               options.max_num,
+               frozenset(declared_subforms.items()))
+        hash(key)
+    except TypeError:
+        # unhashable options (e.g., nested widget dictionaries); don't cache
+        return formfields_for_xmlobject(model, options=options,
+                                        declared_subforms=declared_subforms)
+
+    model_cache = _formfields_cache.setdefault(model, {})
+    if key not in model_cache:
+        model_cache[key] = formfields_for_xmlobject(model, options=options,
+            declared_subforms=declared_subforms)
+    fields, subforms, formsets, subform_labels = model_cache[key]
+
+    # return copies, since callers update the dictionaries; form fields
+    # are copied so that each form class has its own field instances
+    return SortedDict((name, copy.deepcopy(field)) for name, field in fields.items()), \
+        SortedDict(subforms), SortedDict(formsets), dict(subform_labels)
+
+
+# xmlobject class -> tuple of scalar, NodeField and NodeListField field names
+_field_partitions_cache = weakref.WeakKeyDictionary()
+
+def _field_partitions(xmlobject_class):
+    # names of the xmlobject fields, split on whether they map to
+    # simple values, a single subobject, or a list of subobjects
+    partitions = _field_partitions_cache.get(xmlobject_class)
+    if partitions is None:
+        scalars, nodes, nodelists = [], [], []
+        for name, field in xmlobject_class._fields.items():
+            if isinstance(field, xmlmap.fields.NodeField):
+                nodes.append(name)
+            elif isinstance(field, xmlmap.fields.NodeListField):
+                nodelists.append(name)
+            else:
+                scalars.append(name)
+        partitions = _field_partitions_cache[xmlobject_class] = \
+            (tuple(scalars), tuple(nodes), tuple(nodelists))
+    return partitions
+
+
 def xmlobject_to_dict(instance, fields=None, exclude=None, prefix=''):
     """
     Generate a dictionary based on the data in an XmlObject instance to pass as
@@ -323,36 +484,89 @@ def xmlobject_to_dict(instance, fields=None, exclude=None, prefix=''):
     :param fields: optional list of fields - if specified, only the named fields
             will be included in the data returned
     :param exclude: optional list of fields to exclude from the data
+
+    ``fields`` and ``exclude`` may also be parsed field lists (as used by
+    :class:`XmlObjectForm`), in which case any subform fields listed are
+    applied to the data for the corresponding subobjects.
     """
     data = {}
     # convert prefix to combining form for convenience
-    if prefix:
-        prefix = '%s-' % prefix
-    else:
-        prefix = ''
-
-    for name, field in six.iteritems(instance._fields):
-        # not editable?
-        if fields and not name in fields:
-            continue
-        if exclude and name in exclude:
-            continue
-        if isinstance(field, xmlmap.fields.NodeField):
+    prefix = prefix + '-' if prefix else ''
+
+    # walk the instance and its subobjects with an explicit stack of
+    # (instance, prefix, fields, exclude), writing into a single dictionary
+    stack = [(instance, prefix, fields, exclude)]
+    while stack:
+        instance, prefix, fields, exclude = stack.pop()
+
+        subfields = subexclude = {}
+        if isinstance(fields, ParsedFieldList):
+            fields, subfields = fields.fields_set, fields.subfields
+        if isinstance(exclude, ParsedFieldList):
+            exclude, subexclude = exclude.fields_set, exclude.subfields
+
+        partitions = _field_partitions(type(instance))
+        if fields or exclude:
+            # not editable?
+            partitions = [[name for name in names
+                           if (not fields or name in fields)
+                           and not (exclude and name in exclude)]
+                          for names in partitions]
+        scalars, nodes, nodelists = partitions
+
+        for name in scalars:
+            data[prefix + name] = getattr(instance, name)
+        for name in nodes:
             nodefield = getattr(instance, name)
             if nodefield is not None:
-                subprefix = '%s%s' % (prefix, name)
-                node_data = xmlobject_to_dict(nodefield, prefix=subprefix)
-                data.update(node_data)   # FIXME: fields/exclude
-        if isinstance(field, xmlmap.fields.NodeListField):
+                stack.append((nodefield, prefix + name + '-',
+                              subfields.get(name), subexclude.get(name)))
+        for name in nodelists:
+            list_prefix = prefix + name + '-'
             for i, child in enumerate(getattr(instance, name)):
-                subprefix = '%s%s-%d' % (prefix, name, i)
-                node_data = xmlobject_to_dict(child, prefix=subprefix)
-                data.update(node_data)   # FIXME: fields/exclude
-        else:
-            data[prefix + name] = getattr(instance, name)
+                stack.append((child, '%s%d-' % (list_prefix, i),
+                              subfields.get(name), subexclude.get(name)))
 
     return data
 
+def _split_section(template):
+    # split an html section template with %(label)s and %(content)s
+    # placeholders into the (before label, between, after content) strings
+    # surrounding them, so sections can be output without string formatting
+    before, rest = template.split('%(label)s')
+    between, after = rest.split('%(content)s')
+    return (before, between, after)
+
+#: html section templates for subforms in :meth:`XmlObjectForm.as_table`,
+#: :meth:`~XmlObjectForm.as_p`, and :meth:`~XmlObjectForm.as_ul` output
+_SECTION_TABLE = _split_section('<tbody><tr><th colspan="2" class="section">%(label)s</th></tr><tr><td colspan="2"><table class="subform">\n%(content)s</table></td></tr></tbody>')
+_SECTION_P = _split_section('<div class="subform"><p class="label">%(label)s</p>%(content)s</div>')
+_SECTION_UL = _split_section('<li class="subform"><p class="label">%(label)s</p><ul>%(content)s</ul></li>')
+
+
+class _SubformClasses(object):
+    """Descriptor for the subform or formset classes of an
+    :class:`XmlObjectForm`.  Accessed on the form class, returns the
+    dictionary of classes.  Accessed on a form instance, initializes the
+    subforms or formsets for that form on first use (via the named init
+    method, which stores them on the instance), so forms only create
+    subforms and their model instance nodes when they are needed."""
+
+    def __init__(self, name, init_method, classes):
+        self.name = name
+        self.init_method = init_method
+        self.classes = classes
+
+    def __get__(self, instance, owner):
+        # before the form has been initialized (e.g., in a subclass
+        # __init__ before calling XmlObjectForm.__init__), there is no
+        # instance or data to initialize with; return the classes
+        if instance is None or '_subform_init_args' not in instance.__dict__:
+            return self.classes
+        getattr(instance, self.init_method)(*instance._subform_init_args)
+        return instance.__dict__[self.name]
+
+
 class XmlObjectFormType(type):
     """
     Metaclass for :class:`XmlObject`.
@@ -366,26 +580,26 @@ class XmlObjectFormType(type):
     """
     def __new__(cls, name, bases, attrs):
         # let django do all the work of finding declared/inherited fields
-        fields = [(field_name, attrs.pop(field_name)) for field_name, obj in list(six.iteritems(attrs)) if isinstance(obj, Field)]
+        fields = [(field_name, attrs.pop(field_name)) for field_name, obj in list(attrs.items()) if isinstance(obj, Field)]
         for base in bases[::-1]:
                 if hasattr(base, 'declared_fields'):
-                        fields = list(six.iteritems(base.declared_fields)) + fields
+                        fields = list(base.declared_fields.items()) + fields
         tmp_fields = SortedDict(fields)
         declared_fields = {}
         declared_subforms = {}
         declared_subform_labels = {}
         # sort declared fields into sub-form overrides and regular fields
-        for fname, f in six.iteritems(tmp_fields):
+        for fname, f in tmp_fields.items():
             if isinstance(f, SubformField):
                 # FIXME: pass can_delete, can_delete from subformfield to formset?
                 declared_subforms[fname] = f.formclass
                 # if a declared subform fields has a label specified, store it
-                if hasattr(f, 'form_label') and f.form_label is not None:
-                    declared_subform_labels[fname] = f.form_label
+                form_label = getattr(f, 'form_label', None)
                 # if a subformclass has a label, use that
-                elif hasattr(f.formclass, 'form_label') and \
-                         f.formclass.form_label is not None:
-                    declared_subform_labels[fname] = f.formclass.form_label
+                if form_label is None:
+                    form_label = getattr(f.formclass, 'form_label', None)
+                if form_label is not None:
+                    declared_subform_labels[fname] = form_label
             else:
                 declared_fields[fname] = f
 
@@ -395,28 +609,44 @@ class XmlObjectFormType(type):
         opts = new_class._meta =  SubformAwareModelFormOptions(getattr(new_class, 'Meta',  None))
         if opts.model:
             # if a model is defined, get xml fields and any subform classes
-            fields, subforms, formsets, subform_labels = formfields_for_xmlobject(opts.model, options=opts,
-                    declared_subforms=declared_subforms)
+            fields, subforms, formsets, subform_labels = _cached_formfields_for_xmlobject(
+                    opts.model, opts, declared_subforms)
 
             # Override default model fields with any custom declared ones
             # (plus, include all the other declared fields).
             fields.update(declared_fields)
 
             # store all of the dynamically generated xmlobjectforms for nodefields
-            new_class.subforms = subforms
+            new_class.subforms = _SubformClasses('subforms', '_init_subforms', subforms)
+            # names of the instance methods that create each subform node
+            new_class._subform_creators = tuple((name, 'create_' + name)
+                                                for name in subforms)
 
             # and for listfields
-            new_class.formsets = formsets
+            new_class.formsets = _SubformClasses('formsets', '_init_formsets', formsets)
 
             # labels for subforms that couldn't be set by formfields_for_xmlobject
             # declared subform labels should supercede verbose xmlobject field names
             subform_labels.update(declared_subform_labels)
             new_class.subform_labels = subform_labels
 
+            # names of instance fields to be updated from cleaned form data,
+            # in update order: order as declared in the form fields list
+            # if there is one, otherwise xmlobject field order
+            if opts.parsed_fields:
+                update_names = opts.parsed_fields.fields
+            else:
+                update_names = opts.model._fields
+            exclude = opts.parsed_exclude.fields_set if opts.parsed_exclude else ()
+            new_class._update_field_names = tuple(SortedDict.fromkeys(
+                name for name in update_names if name not in exclude))
+
         else:
             fields = declared_fields
-            new_class.subforms = {}
-            new_class.formsets = {}
+            new_class.subforms = _SubformClasses('subforms', '_init_subforms', {})
+            new_class._subform_creators = ()
+            new_class.formsets = _SubformClasses('formsets', '_init_formsets', {})
+            new_class._update_field_names = ()
 
         new_class.declared_fields = declared_fields
         new_class.base_fields = fields
@@ -453,18 +683,27 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
     :meth:`update_instance`.
     """
 
-    _html_section = None    # formatting for outputting object with subform
+    _html_section = None    # formatting for outputting object with subform;
+                            # a format string or tuple from _split_section
+    _instance_initial_pending = False   # instance initial data not yet generated
 
     subforms = {}
     """Sorted Dictionary of :class:`XmlObjectForm` instances for fields of type
     :class:`~eulxml.xmlmap.fields.NodeField` belonging to this Form's
     :class:`~eulxml.xmlmap.XmlObject` model, keyed on field name.  Ordered by
-    field creation order or by specified fields."""
+    field creation order or by specified fields.  Subforms are initialized
+    when first accessed."""
 
     form_label = None
     '''Label for this form or subform (set automatically for subforms &
     formsets, using the same logic that is used for field labels.'''
 
+    eager_schema_load = False
+    '''Load the schema for the :class:`~eulxml.xmlmap.XmlObject` instance
+    (if any) when the form is initialized, so that an unavailable schema is
+    reported before form submission.  By default, the schema is not loaded
+    until :meth:`is_valid` is called.'''
+
     def __init__(self, data=None, instance=None, prefix=None, initial={}, **kwargs):
         opts = self._meta
         # make a copy of any initial data for local use, since it may get updated with instance data
@@ -482,19 +721,25 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
             self.instance = instance
             # generate dictionary of initial data based on current instance
             # allow initial data from instance to co-exist with other initial data
-            local_initial.update(xmlobject_to_dict(self.instance)) #, prefix=prefix))  # fields, exclude?
+            # - bound forms rarely need initial data, so defer generating it
+            # until it is requested (see initial)
+            if data is None:
+                local_initial.update(self._instance_initial())
+            else:
+                self._instance_initial_pending = True
             # FIXME: is this backwards? should initial data override data from instance?
 
-
-        # In case XmlObject has a schema associated, make sure the
-        # schema is accessible on load, so any schema-unavailability
+        # In case XmlObject has a schema associated, optionally make sure
+        # the schema is accessible on load, so any schema-unavailability
         # on lazy-loaded schemas is discovered *before* form
         # submission & validation.
-        self.instance.xmlschema
+        if self.eager_schema_load:
+            self.instance.xmlschema
 
-        # initialize subforms for all nodefields that belong to the xmlobject model
-        self._init_subforms(data, prefix)
-        self._init_formsets(data, prefix)
+        # subforms for all nodefields that belong to the xmlobject model
+        # are initialized on first access with this data and prefix
+        # (see _SubformClasses)
+        self._subform_init_args = (data, prefix)
 
         super_init = super(XmlObjectForm, self).__init__
         super_init(data=data, prefix=prefix, initial=local_initial, **kwargs)
@@ -502,29 +747,45 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
         #    files, auto_id, object_data,
         #    error_class, label_suffix, empty_permitted
 
+    def _instance_initial(self):
+        # initial data for the form fields, based on the current instance
+        return xmlobject_to_dict(self.instance, fields=self._meta.parsed_fields,
+                                 exclude=self._meta.parsed_exclude)
+
+    @property
+    def initial(self):
+        '''Initial data for the form, including data from the instance.  For
+        bound forms, instance data is added the first time this is accessed.'''
+        if self._instance_initial_pending:
+            self._instance_initial_pending = False
+            self._initial.update(self._instance_initial())
+        return self._initial
+
+    @initial.setter
+    def initial(self, value):
+        self._initial = value
+
     def _init_subforms(self, data=None, prefix=None):
         # initialize each subform class with the appropriate model instance and data
         self.subforms = SortedDict()    # create as sorted dictionary to preserve order
-        for name, subform in six.iteritems(self.__class__.subforms):
+        subform_classes = self.__class__.subforms
+        prefix = prefix + '-' if prefix else ''
+        for name, create_name in self._subform_creators:
+            subform = subform_classes[name]
             # instantiate the new form with the current field as instance, if available
             if self.instance is not None:
                 # get the relevant instance for the current NodeField variable
                 # NOTE: calling create_foo will create the nodefield for element foo
                 # creating here so subfields will be set correctly
                 # if the resulting field is empty, it will be removed by update_instance
-                getattr(self.instance, 'create_' + name)()
+                getattr(self.instance, create_name)()
                 subinstance = getattr(self.instance, name, None)
             else:
                 subinstance = None
 
-            if prefix:
-                subprefix = '%s-%s' % (prefix, name)
-            else:
-                subprefix = name
-
             # instantiate the subform class with field data and model instance
             # - setting prefix based on field name, to distinguish similarly named fields
-            newform = subform(data=data, instance=subinstance, prefix=subprefix)
+            newform = subform(data=data, instance=subinstance, prefix=prefix + name)
             # depending on how the subform was declared, it may not have a label yet
             if newform.form_label is None:
                 if name in self.subform_labels:
@@ -534,18 +795,15 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
 
     def _init_formsets(self, data=None, prefix=None):
         self.formsets = {}
-        for name, formset in six.iteritems(self.__class__.formsets):
+        prefix = prefix + '-' if prefix is not None else ''
+        for name, formset in self.__class__.formsets.items():
             if self.instance is not None:
                 subinstances = getattr(self.instance, name, None)
             else:
                 subinstances = None
 
-            if prefix is not None:
-                subprefix = '%s-%s' % (prefix, name)
-            else:
-                subprefix = name
-
-            self.formsets[name] = formset(data=data, instances=subinstances, prefix=subprefix)
+            self.formsets[name] = formset(data=data, instances=subinstances,
+                                          prefix=prefix + name)
 
     def update_instance(self):
         """Save bound form data into the XmlObject model instance and return the
@@ -557,30 +815,14 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
 
         if hasattr(self, 'cleaned_data'):   # possible to have an empty object/no data
 
-            opts = self._meta
-
             # NOTE: _fields doesn't seem to order, which is
             # problematic for some xml (e.g., where order matters for validity)
 
             # use field order as declared in the form for update order
-            # when possible.
+            # when possible (see XmlObjectFormType).
             # (NOTE: this could be problematic also, since display order may
             # not always be the same as schema order)
-            fields_in_order = []
-            if hasattr(self.Meta, 'fields'):
-                fields_in_order.extend(self.Meta.fields)
-                fields_in_order.extend([name for name in six.iterkeys(self.instance._fields)
-                                        if name in self.Meta.fields])
-            else:
-                fields_in_order = self.instance._fields.keys()
-
-            for name in fields_in_order:
-            # for name in self.instance._fields.iterkeys():
-            # for name in self.declared_fields.iterkeys():
-                if opts.fields and name not in opts.parsed_fields.fields:
-                    continue
-                if opts.exclude and name in opts.parsed_exclude.fields:
-                    continue
+            for name in self._update_field_names:
                 if name in self.cleaned_data:
                     # special case: we don't want empty attributes and elements
                     # for fields which returned no data from the form
@@ -590,9 +832,9 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
                     setattr(self.instance, name, self.cleaned_data[name])
 
             # update sub-model portions via any subforms
-            for name, subform in six.iteritems(self.subforms):
+            for name, subform in self.subforms.items():
                 self._update_subinstance(name, subform)
-            for formset in six.itervalues(self.formsets):
+            for formset in self.formsets.values():
                 formset.update_instance()
         return self.instance
 
@@ -601,15 +843,17 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
         instance."""
         old_subinstance = getattr(self.instance, name)
         new_subinstance = subform.update_instance()
+        new_is_empty = new_subinstance.is_empty()
 
-        # if our instance previously had no node for the subform AND the
-        # updated one has data, then attach the new node.
-        if old_subinstance is None and not new_subinstance.is_empty():
-            setattr(self.instance, name, new_subinstance)
+        if old_subinstance is None:
+            # if our instance previously had no node for the subform AND the
+            # updated one has data, then attach the new node.
+            if not new_is_empty:
+                setattr(self.instance, name, new_subinstance)
 
         # on the other hand, if the instance previously had a node for the
         # subform AND the updated one is empty, then remove the node.
-        if old_subinstance is not None and new_subinstance.is_empty():
+        elif new_is_empty:
             delattr(self.instance, name)
 
     def is_valid(self):
@@ -627,9 +871,16 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
 
         :rtype: boolean
         """
-        valid = super(XmlObjectForm, self).is_valid() and \
-                all(s.is_valid() for s in six.itervalues(self.subforms)) and \
-                all(s.is_valid() for s in six.itervalues(self.formsets))
+        # make sure any associated schema is available before validating
+        if self.instance is not None:
+            self.instance.xmlschema
+
+        valid = super(XmlObjectForm, self).is_valid()
+        # only initialize and check subforms & formsets if the form has any
+        if valid and self.__class__.subforms:
+            valid = all(s.is_valid() for s in self.subforms.values())
+        if valid and self.__class__.formsets:
+            valid = all(s.is_valid() for s in self.formsets.values())
         # schema validation can only be done after regular validation passes,
         # because xmlobject must be updated with cleaned_data
         if valid and self.instance is not None:
@@ -653,63 +904,111 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
     # NOTE: errors only returned for the *current* form, not for all subforms
     # - appears to be used only for form output, so this should be sensible
 
-    def _html_output(self, normal_row, error_row, row_ender,  help_text_html, errors_on_separate_row):
+    def _html_output(self, normal_row, error_row, row_ender,  help_text_html, errors_on_separate_row,
+                     section=None):
         """Extend BaseForm's helper function for outputting HTML. Used by as_table(), as_ul(), as_p().
 
         Combines the HTML version of the main form's fields with the HTML content
-        for any subforms.
+        for any subforms.  Subforms are wrapped in the specified html section
+        format, if any; otherwise the section set by as_table(), as_ul(), or
+        as_p() is used.
         """
-        parts = []
-        parts.append(super(XmlObjectForm, self)._html_output(normal_row, error_row, row_ender,
-                help_text_html, errors_on_separate_row))
+        output = super(XmlObjectForm, self)._html_output(normal_row, error_row,
+                row_ender, help_text_html, errors_on_separate_row)
+        # no subforms or formsets: main form output is all there is
+        if not self.__class__.subforms and not self.__class__.formsets:
+            return mark_safe(output)
+
+        # write output directly to a buffer rather than collecting and
+        # joining a list of parts
+        buf = StringIO()
+        # local references for use in the subform and formset loops
+        write = buf.write
+        subform_output = self._html_subform_output
+        if section is None:
+            section = self._html_section
+        write(output)
 
         def _subform_output(subform):
-            return subform._html_output(normal_row, error_row, row_ender,
-                                        help_text_html, errors_on_separate_row)
-
-        for name, subform in six.iteritems(self.subforms):
+            args = (normal_row, error_row, row_ender, help_text_html,
+                    errors_on_separate_row)
+            # pass the html section along in case of any sub-subforms
+            if isinstance(subform, XmlObjectForm):
+                return subform._html_output(*args, section=section)
+            return subform._html_output(*args)
+
+        for name, subform in self.subforms.items():
             # use form label if one was set
-            if hasattr(subform, 'form_label'):
-                name = subform.form_label
-            parts.append(self._html_subform_output(subform, name, _subform_output))
-
-        for name, formset in six.iteritems(self.formsets):
-            parts.append(u(formset.management_form))
+            label = getattr(subform, 'form_label', None)
+            if label is not None:
+                name = label
+            write('\n')
+            subform_output(subform, name, _subform_output, out=buf,
+                           section=section)
+
+        for name, formset in self.formsets.items():
+            write('\n')
+            write(u(formset.management_form))
             # use form label if one was set
-            # - use declared subform label if any
-            if hasattr(formset.forms[0], 'form_label') and \
-                    formset.forms[0].form_label is not None:
-                 name = formset.forms[0].form_label
+            # - use declared subform label if any (checked on the formset
+            #   form class, since the formset may not have any forms)
+            label = getattr(formset.form, 'form_label', None)
             # fallback to generated label from field name
-            elif hasattr(formset, 'form_label'):
-                name = formset.form_label
+            if label is None:
+                label = getattr(formset, 'form_label', None)
+            if label is not None:
+                name = label
+
+            write('\n')
+            # all forms are wrapped in a single section container, so the
+            # formset label appears once; with a pre-split section template,
+            # write the forms directly between the section head and tail
+            if isinstance(section, tuple):
+                write(section[0])
+                write(fieldname_to_label(name))
+                write(section[1])
+                formset_write = write
+            else:
+                formset_buf = StringIO()
+                formset_write = formset_buf.write
 
-            # collect the html output for all the forms in the formset
-            subform_parts = list()
+            # forms are output without a section, so render them directly
+            for i, subform in enumerate(formset.forms):
+                if i:
+                    formset_write('\n')
+                formset_write(_subform_output(subform))
 
-            for subform in formset.forms:
-                subform_parts.append(self._html_subform_output(subform,
-                                      gen_html=_subform_output, suppress_section=True))
-            # then wrap all forms in the section container, so formset label appears once
-            parts.append(self._html_subform_output(name=name, content=u'\n'.join(subform_parts)))
+            if isinstance(section, tuple):
+                write(section[2])
+            else:
+                subform_output(name=name, content=formset_buf.getvalue(), out=buf,
+                               section=section)
 
-        return mark_safe(u'\n'.join(parts))
+        return mark_safe(buf.getvalue())
 
     def _html_subform_output(self, subform=None, name=None, gen_html=None, content=None,
-                             suppress_section=False):
+                             suppress_section=False, out=None, section=None):
+        # returns the html for a subform, or writes it to ``out`` if specified;
+        # uses the form's configured html section unless one is specified
+        if section is None:
+            section = self._html_section
 
-        # pass the configured html section to subform in case of any sub-subforms
-        if subform is not None:
-            subform._html_section = self._html_section
-            if gen_html is not None:
-                content = gen_html(subform)
+        if subform is not None and gen_html is not None:
+            content = gen_html(subform)
 
         # if html section is configured, add section label and wrapper for
-        if self._html_section is not None and not suppress_section:
-            return self._html_section % \
-                {'label': fieldname_to_label(name), 'content': content}
-        else:
+        if section is not None and not suppress_section:
+            if isinstance(section, tuple):
+                # pre-split section template (see _split_section)
+                content = ''.join((section[0], fieldname_to_label(name),
+                                   section[1], content, section[2]))
+            else:
+                content = section % \
+                    {'label': fieldname_to_label(name), 'content': content}
+
+        if out is None:
             return content
+        out.write(content)
 
 
     # intercept the three standard html output formats to set an appropriate section format
@@ -721,7 +1020,7 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
         Subforms, if any, will be grouped in a <tbody> labeled with a heading
         based on the label of the field.
         """
-        self._html_section = u'<tbody><tr><th colspan="2" class="section">%(label)s</th></tr><tr><td colspan="2"><table class="subform">\n%(content)s</table></td></tr></tbody>'
+        self._html_section = _SECTION_TABLE
         #self._html_section = u'<tbody><tr><th class="section" colspan="2">%(label)s</th></tr>\n%(content)s</tbody>'
         return super(XmlObjectForm, self).as_table()
 
@@ -733,7 +1032,7 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
         Subforms, if any, will be grouped in a <div> of class 'subform',
         with a heading based on the label of the field.
         """
-        self._html_section = u'<div class="subform"><p class="label">%(label)s</p>%(content)s</div>'
+        self._html_section = _SECTION_P
         return super(XmlObjectForm, self).as_p()
 
     def as_ul(self):
@@ -744,7 +1043,7 @@ class XmlObjectForm(six.with_metaclass(XmlObjectFormType, BaseForm)):
         Subforms, if any, will be grouped in a <ul> of class 'subform',
         with a heading based on the label of the field.
         """
-        self._html_section = u'<li class="subform"><p class="label">%(label)s</p><ul>%(content)s</ul></li>'
+        self._html_section = _SECTION_UL
         return super(XmlObjectForm, self).as_ul()
 
 
@@ -793,40 +1092,69 @@ def xmlobjectform_factory(model, form=XmlObjectForm, fields=None, exclude=None,
 
     return XmlObjectFormType(class_name, (form,), form_class_attrs)
 
+class _InstancesInitial(object):
+    # read-only sequence of initial data for a list of xmlobject instances,
+    # generating the data for each instance only when it is requested
+    def __init__(self, instances):
+        self.instances = instances if instances is not None else []
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __getitem__(self, i):
+        return xmlobject_to_dict(self.instances[i])
+
+
 class BaseXmlObjectFormSet(BaseFormSet):
     def __init__(self, instances, **kwargs):
         self.instances = instances
+        # initial data for each instance is only generated when accessed;
+        # the forms generate their own initial data from the instances
+        # (see _construct_form)
         if 'initial' not in kwargs:
-            kwargs['initial'] = [ xmlobject_to_dict(instance) for instance in instances ]
+            kwargs['initial'] = _InstancesInitial(instances)
         super_init = super(BaseXmlObjectFormSet, self).__init__
         super_init(**kwargs)
 
     def _construct_form(self, i, **kwargs):
         try:
             defaults = { 'instance': self.instances[i] }
-        except:
+        # extra forms beyond the instance list (or no instance list)
+        except (IndexError, TypeError):
             defaults = {}
+        if isinstance(self.initial, _InstancesInitial):
+            # form initial data comes from the instance
+            defaults['initial'] = {}
         defaults.update(kwargs)
 
         super_construct = super(BaseXmlObjectFormSet, self)._construct_form
         return super_construct(i, **defaults)
 
     def update_instance(self):
-        for form in getattr(self, 'deleted_forms', []):
-            # update_instance may be called multiple times - instance can only
-            # be removed the first time, so don't consider it an error if it's not present
-            if form.instance in self.instances:
-                self.instances.remove(form.instance)
-
+        instances = self.instances
+        # xml nodes for instances to be removed from the list
+        remove_nodes = set(form.instance.node
+                           for form in getattr(self, 'deleted_forms', []))
         # if forms can be ordered, remove existing records and re-add
         # in the appropriate order so that any changes in order are
         # reflected in the xml
         if self.can_order:
-            for form in self.ordered_forms:
-                if form.instance in self.instances:
-                    self.instances.remove(form.instance)
+            ordered_forms = self.ordered_forms
+            remove_nodes.update(form.instance.node for form in ordered_forms)
+
+        # remove in a single pass over the current list, matching on xml node;
+        # update_instance may be called multiple times - instance can only
+        # be removed the first time, so don't consider it an error if it's not present
+        if remove_nodes:
+            current = list(instances)
+            for i in reversed(range(len(current))):
+                if current[i].node in remove_nodes:
+                    del instances[i]
+
+        if self.can_order:
+            for form in ordered_forms:
                 form.update_instance()
-                self.instances.append(form.instance)
+                instances.append(form.instance)
 
         else:
             for form in self.initial_forms:
@@ -914,7 +1242,8 @@ class BaseXmlObjectListFieldFormSet(BaseFormSet):
         # initialize forms, passing in the appropriate initial data from the instance list
         try:
             defaults = {'instance': self.instance[i] }
-        except:
+        # extra forms beyond the instance list (or no instance list)
+        except (IndexError, TypeError):
             defaults = {}
         defaults.update(kwargs)
 
@@ -925,6 +1254,5 @@ class BaseXmlObjectListFieldFormSet(BaseFormSet):
         values = [form.value for form in self.forms if form.value]
 
         # replace current list contents with new values
-        while len(self.instance):
-            self.instance.pop()
+        self.instance.clear()
         self.instance.extend(values)
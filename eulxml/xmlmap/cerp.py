@@ -20,7 +20,14 @@ import datetime
 import email
 import logging
 import os
-
+import re
+try:
+    from functools import lru_cache
+except ImportError:
+    # not available in python 2
+    lru_cache = None
+
+from lxml import etree
 import six
 
 from eulxml import xmlmap
@@ -41,6 +48,26 @@ class _BaseCerp(xmlmap.XmlObject):
     ROOT_NAMESPACES = { 'xm': ROOT_NS }
 
 
+def _node_fields(*fields):
+    # qualify element names for use with _first_node_field; fields are
+    # (element name, field name) pairs, in order of preference
+    return tuple(('{%s}%s' % (_BaseCerp.ROOT_NS, tag), name)
+                 for tag, name in fields)
+
+
+def _first_node_field(xmlobject, fields):
+    # return the value of the first of several node fields (as generated
+    # by _node_fields) that is present, finding the elements in a single
+    # pass over the children rather than a separate lookup for each field
+    found = {}
+    for child in xmlobject.node.iterchildren(*[tag for tag, name in fields]):
+        if child.tag not in found:
+            found[child.tag] = child
+    for tag, name in fields:
+        if tag in found:
+            return xmlobject._fields[name].mapper.to_python(found[tag])
+
+
 class Parameter(_BaseCerp):
     ROOT_NAME = 'Parameter'
     name = xmlmap.StringField('xm:Name')
@@ -140,11 +167,12 @@ class SingleBody(_BaseBody):
     body_content = xmlmap.NodeField('xm:BodyContent', BodyContent)
     ext_body_content = xmlmap.NodeField('xm:ExtBodyContent', ExtBodyContent)
     child_message = xmlmap.NodeField('xm:ChildMessage', None) # this will be fixed below
+    _content_fields = _node_fields(('BodyContent', 'body_content'),
+                                   ('ExtBodyContent', 'ext_body_content'),
+                                   ('ChildMessage', 'child_message'))
     @property
     def content(self):
-        return self.body_content or \
-               self.ext_body_content or \
-               self.child_message
+        return _first_node_field(self, self._content_fields)
 
     phantom_body = xmlmap.StringField('xm:PhantomBody')
 
@@ -156,9 +184,11 @@ class MultiBody(_BaseCerp):
 
     single_body = xmlmap.NodeField('xm:SingleBody', SingleBody)
     multi_body = xmlmap.NodeField('xm:MultiBody', 'self')
+    _body_fields = _node_fields(('SingleBody', 'single_body'),
+                                ('MultiBody', 'multi_body'))
     @property
     def body(self):
-        return self.single_body or self.multi_body
+        return _first_node_field(self, self._body_fields)
 
 
 class Incomplete(_BaseCerp):
@@ -195,9 +225,11 @@ class _BaseMessage(_BaseCerp):
 
     single_body = xmlmap.NodeField('xm:SingleBody', SingleBody)
     multi_body = xmlmap.NodeField('xm:MultiBody', MultiBody)
+    _body_fields = _node_fields(('SingleBody', 'single_body'),
+                                ('MultiBody', 'multi_body'))
     @property
     def body(self):
-        return self.single_body or self.multi_body
+        return _first_node_field(self, self._body_fields)
 
     incomplete_list = xmlmap.NodeField('xm:Incomplete', Incomplete)
 
@@ -223,7 +255,7 @@ class Message(_BaseMessage, _BaseExternal):
         id is specified, it will be stored in the Message <LocalId>.
 
         :param message: `email.message.Message` object
-        :param id: optional message id to be set as `local_id`
+        :param local_id: optional message id to be set as `local_id`
 
         :returns: :class:`eulxml.xmlmap.cerp.Message` instance populated
     	    with message information
@@ -231,34 +263,41 @@ class Message(_BaseMessage, _BaseExternal):
         '''
         result = cls()
         if local_id is not None:
-            result.local_id = id
+            result.local_id = local_id
+
+        # collect header values by (case-insensitive) name in a single pass
+        # over the message headers
+        items = message.items()
+        headers_by_name = {}
+        for key, val in items:
+            headers_by_name.setdefault(key.lower(), []).append(val)
+
+        def get_all(name):
+            return headers_by_name.get(name, [])
 
-        message_id = message.get('Message-Id')
-        if message_id:
+        message_id = get_all('message-id')
+        if message_id and message_id[0]:
+            result.message_id = message_id[0]
             result.message_id_supplied = True
-            result.message_id = message_id
 
-        result.mime_version = message.get('MIME-Version')
+        mime_version = get_all('mime-version')
+        result.mime_version = mime_version[0] if mime_version else None
 
-        dates = message.get_all('Date', [])
+        dates = get_all('date')
         result.orig_date_list.extend([parse_mail_date(d) for d in dates])
 
-        result.from_list.extend(message.get_all('From', []))
-        result.sender_list.extend(message.get_all('From', []))
-        try:
-            result.to_list.extend(message.get_all('To', []))
-        except UnicodeError:
-            print(repr(message['To']))
-            raise
-        result.cc_list.extend(message.get_all('Cc', []))
-        result.bcc_list.extend(message.get_all('Bcc', []))
-        result.in_reply_to_list.extend(message.get_all('In-Reply-To', []))
-        result.references_list.extend(message.get_all('References', []))
-        result.subject_list.extend(message.get_all('Subject', []))
-        result.comments_list.extend(message.get_all('Comments', []))
-        result.keywords_list.extend(message.get_all('Keywords', []))
-
-        headers = [ Header(name=key, value=val) for key, val in message.items() ]
+        result.from_list.extend(get_all('from'))
+        result.sender_list.extend(get_all('sender'))
+        result.to_list.extend(get_all('to'))
+        result.cc_list.extend(get_all('cc'))
+        result.bcc_list.extend(get_all('bcc'))
+        result.in_reply_to_list.extend(get_all('in-reply-to'))
+        result.references_list.extend(get_all('references'))
+        result.subject_list.extend(get_all('subject'))
+        result.comments_list.extend(get_all('comments'))
+        result.keywords_list.extend(get_all('keywords'))
+
+        headers = [ Header(name=key, value=val) for key, val in items ]
         result.headers.extend(headers)
 
         # FIXME: skip multipart messages for now
@@ -288,31 +327,52 @@ class Message(_BaseMessage, _BaseExternal):
                 charset = message.get_charset()
                 # decode according to the specified character set, if any
                 if charset is not None:
-                    charset_decoder = codecs.getdecoder(str(charset))
+                    charset_decoder = _get_decoder(str(charset))
                     payload, length = charset_decoder(payload)
 
                 # otherwise, just try to convert
                 else:
                     payload = u(payload)
 
+            if not isinstance(payload, six.text_type):
+                payload = u(payload)
             # remove any control characters not allowed in XML
-            control_char_map = dict.fromkeys(range(32))
-            for i in [9, 10, 13]: # preserve horizontal tab, line feed, carriage return
-                del control_char_map[i]
-
-            payload = u(payload).translate(control_char_map)
+            if _CONTROL_CHAR_RE.search(payload):
+                payload = payload.translate(_CONTROL_CHAR_MAP)
 
             result.single_body.body_content.content = payload
 
         else:
             # TODO: handle multipart
-            logger.warn('CERP conversion does not yet handle multipart')
+            logger.warning('CERP conversion does not yet handle multipart')
 
         # assume we've normalized newlines:
         result.eol = EOLMAP[os.linesep]
 
         return result
 
+    @classmethod
+    def iter_from_file(cls, source):
+        '''
+        Iterate over the messages in a CERP XML file (e.g., an
+        :class:`Account` or :class:`Folder`) without loading the entire
+        document into memory.  Messages are parsed incrementally, and
+        each message is cleared from the document once the next one is
+        requested, so a :class:`Message` returned by this method should
+        not be used after iteration continues.
+
+        :param source: filename or file-like object with CERP XML content
+
+        :returns: generator of :class:`eulxml.xmlmap.cerp.Message` instances
+        '''
+        tag = '{%s}%s' % (cls.ROOT_NS, cls.ROOT_NAME)
+        for event, element in etree.iterparse(source, events=('end',), tag=tag):
+            yield cls(element)
+            # free the message content and any previously-processed siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
 
 class ChildMessage(_BaseMessage):
     ROOT_NAME = 'ChildMessage'
@@ -331,6 +391,10 @@ class Mbox(_BaseExternal):
     # no additional fields
 
 
+_ALL_HASHES = etree.XPath('.//xm:Hash', namespaces=_BaseCerp.ROOT_NAMESPACES)
+_ALL_MESSAGES = etree.XPath('.//xm:Message', namespaces=_BaseCerp.ROOT_NAMESPACES)
+
+
 class Folder(_BaseCerp):
     """A single email folder in an :class:`Account`, composed of multiple
     :class:`Message` objects and associated metadata."""
@@ -342,6 +406,59 @@ class Folder(_BaseCerp):
     subfolders = xmlmap.NodeListField('xm:Folder', 'self')
     mboxes = xmlmap.NodeListField('xm:Mbox', Mbox)
 
+    def all_hashes(self):
+        '''All :class:`Hash` elements anywhere in this folder (e.g., for
+        messages, external body content, mboxes, and subfolders), found in
+        a single pass over the folder content.
+
+        :returns: list of :class:`Hash` instances
+        '''
+        return [Hash(node) for node in _ALL_HASHES(self.node)]
+
+    def all_messages(self):
+        '''All :class:`Message` elements in this folder and any of its
+        subfolders (at any depth), in document order, found in a single
+        pass over the folder content.  Child messages included in a
+        message body (see :class:`ChildMessage`) are not included.
+
+        :returns: list of :class:`Message` instances
+        '''
+        return [Message(node) for node in _ALL_MESSAGES(self.node)]
+
+    def to_columns(self, fields=('orig_date_list', 'from_list', 'to_list',
+                                 'subject_list')):
+        '''Collect the values of several :class:`Message` list fields for
+        all messages in this folder, organized by field rather than by
+        message (e.g., for reporting on senders and dates across a whole
+        folder).  Each message is scanned once for all requested fields,
+        without initializing a :class:`Message` for each one.
+
+        :param fields: names of :class:`Message` string list fields that
+            map to a single child element, e.g. ``from_list``
+        :returns: dictionary keyed on field name; each value is a list
+            with one entry per message (in document order), which is the
+            list of values for that field on that message
+        '''
+        columns_by_tag = {}
+        for name in fields:
+            field = Message._fields.get(name)
+            if not isinstance(field, xmlmap.StringListField) or \
+                    not re.match(r'^xm:\w+$', field.xpath):
+                raise ValueError('%s is not a Message string list field' % name)
+            tag = '{%s}%s' % (self.ROOT_NS, field.xpath[len('xm:'):])
+            columns_by_tag[tag] = (name, field.mapper)
+
+        columns = dict((name, []) for name in fields)
+        tags = list(columns_by_tag)
+        for message in self.node.iterchildren('{%s}Message' % self.ROOT_NS):
+            values = dict((name, []) for name in fields)
+            for child in message.iterchildren(*tags):
+                name, mapper = columns_by_tag[child.tag]
+                values[name].append(mapper.to_python(child))
+            for name in fields:
+                columns[name].append(values[name])
+        return columns
+
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.name)
 
@@ -377,6 +494,15 @@ class Account(_BaseCerp):
 
 
 
+def _get_decoder(charset):
+    # codec registry lookup for a message charset; the same few charsets
+    # are used by nearly every message, so cache where possible
+    return codecs.getdecoder(charset)
+
+if lru_cache is not None:
+    _get_decoder = lru_cache(maxsize=64)(_get_decoder)
+
+
 def parse_mail_date(datestr):
     '''Helper method used by :meth:`Message.from_email_message` to
     convert dates from rfc822 format to iso 8601.
@@ -391,8 +517,20 @@ def parse_mail_date(datestr):
     dt = datetime.datetime.fromtimestamp(email.utils.mktime_tz(time_tuple))
     return dt.isoformat()
 
+# date headers are frequently repeated across messages in a folder
+if lru_cache is not None:
+    parse_mail_date = lru_cache(maxsize=4096)(parse_mail_date)
+
 EOLMAP = {
     '\r': 'CR',
     '\n': 'LF',
     '\r\n': 'CRLF',
 }
+
+# translation table removing control characters not allowed in XML,
+# preserving horizontal tab, line feed, carriage return
+_CONTROL_CHAR_MAP = dict.fromkeys(range(32))
+for _i in (9, 10, 13):
+    del _CONTROL_CHAR_MAP[_i]
+del _i
+_CONTROL_CHAR_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
@@ -16,15 +16,11 @@
 
 from __future__ import unicode_literals
 import logging
-import os
-import warnings
-import urllib
-import time
 from lxml import etree
 from lxml.builder import ElementMaker
 import six
-from six.moves.urllib.request import urlopen
 
+from eulxml import _ensure_catalog
 from eulxml.utils.compat import u
 from eulxml.xmlmap.fields import Field
 
@@ -450,7 +446,7 @@ class XmlObject(six.with_metaclass(XmlObjectType, object)):
         If no stream is specified, returns a string.
         :param stream: stream or other file-like object to write content to (optional)
         :param pretty: pretty-print the XML output; boolean, defaults to False
-        :rtype: stream passed in or an instance of :class:`cStringIO.StringIO`
+        :rtype: stream passed in or bytes
         """
         return self._serialize(self.node, stream=stream, pretty=pretty)
 
@@ -462,28 +458,29 @@ class XmlObject(six.with_metaclass(XmlObjectType, object)):
         If no stream is specified, returns a string.
         :param stream: stream or other file-like object to write content to (optional)
         :param pretty: pretty-print the XML output; boolean, defaults to False
-        :rtype: stream passed in or an instance of :class:`cStringIO.StringIO`
+        :rtype: stream passed in or bytes
         """
         return self._serialize(self.node.getroottree(), stream=stream, pretty=pretty,
                                 xml_declaration=True)
 
     def _serialize(self, node, stream=None, pretty=False, xml_declaration=False):
         # actual logic of xml serialization
-        if stream is None:
-            string_mode = True
-            stream = six.BytesIO()
-        else:
-            string_mode = False
-
         # NOTE: etree c14n doesn't seem to like fedora info: URIs
-        stream.write(etree.tostring(node, encoding='UTF-8', pretty_print=pretty,
-                                    xml_declaration=xml_declaration))
-
-        if string_mode:
-            data = stream.getvalue()
-            stream.close()
+        if stream is not None and isinstance(node, etree._ElementTree):
+            # serialize a full document directly to the stream, without
+            # building the entire serialized document in memory first
+            node.write(stream, encoding='UTF-8', pretty_print=pretty,
+                       xml_declaration=xml_declaration)
+            return stream
+
+        data = etree.tostring(node, encoding='UTF-8', pretty_print=pretty,
+                              xml_declaration=xml_declaration)
+        # if no stream is specified, return the serialized bytes directly
+        # rather than copying them through an intermediate buffer
+        if stream is None:
             return data
 
+        stream.write(data)
         return stream
 
     def is_valid(self):
@@ -561,6 +558,8 @@ def _get_xmlparser(xmlclass=XmlObject, validate=False, resolver=None):
     instance of :class:`XmlObject` has an XSD_SCHEMA defined, that will be used.
     Otherwise, uses DTD validation. Switched resolver to None to skip validation.
     """
+    # make sure the local schema catalog is registered before parsing
+    _ensure_catalog()
     if validate:
         if hasattr(xmlclass, 'XSD_SCHEMA') and xmlclass.XSD_SCHEMA is not None:
             # If the schema has already been loaded, use that.
@@ -589,6 +588,10 @@ def _get_xmlparser(xmlclass=XmlObject, validate=False, resolver=None):
 
     if resolver is not None:
         parser.resolvers.add(resolver)
+    # load schemas and other documents from the local catalog when possible;
+    # imported here since eulxml.catalog depends on xmlmap
+    from eulxml.catalog import catalog_resolver
+    parser.resolvers.add(catalog_resolver)
 
     return parser
 
@@ -18,6 +18,7 @@ from __future__ import unicode_literals
 from copy import deepcopy
 from datetime import datetime, date
 import logging
+import re
 
 from lxml import etree
 from lxml.builder import ElementMaker
@@ -56,7 +57,8 @@ class Field(object):
         # compile xpath in order to catch an invalid xpath at load time
         etree.XPath(xpath)
         # NOTE: not saving compiled xpath because namespaces must be
-        # passed in at compile time when evaluating an etree.XPath on a node
+        # passed in at compile time when evaluating an etree.XPath on a node;
+        # compiled versions are cached per namespace map by _evaluate_xpath
         self.xpath = xpath
         self.manager = manager
         self.mapper = mapper
@@ -99,8 +101,10 @@ class Mapper(object):
 
 class StringMapper(Mapper):
     XPATH = etree.XPath('string()')
+    normalize = False
     def __init__(self, normalize=False):
         if normalize:
+            self.normalize = True
             self.XPATH = etree.XPath('normalize-space(string())')
 
     def to_python(self, node):
@@ -108,6 +112,10 @@ class StringMapper(Mapper):
             return None
         if isinstance(node, six.string_types):
             return node
+        if not self.normalize and isinstance(node, etree._Element) \
+                and not len(node):
+            # element with no children: string value is just the text
+            return six.text_type(node.text or '')
         return self.XPATH(node)
 
 class IntegerMapper(Mapper):
@@ -157,6 +165,9 @@ class SimpleBooleanMapper(Mapper):
 
         if isinstance(node, six.string_types):
             value = node
+        elif isinstance(node, etree._Element) and not len(node):
+            # element with no children: string value is just the text
+            value = node.text or ''
         else:
             value = self.XPATH(node)
         if value == str(self.true):
@@ -264,9 +275,70 @@ def _find_terminal_step(xast):
     return None
 
 
+# compiled etree.XPath objects keyed on xpath string and namespaces;
+# namespaces must be given at compile time, so the same field xpath may
+# be compiled once for each distinct namespace map it is evaluated with
+_xpath_cache = {}
+_XPATH_CACHE_SIZE = 2048
+
+
+# xpaths consisting of a single child element step (e.g. 'xm:Name' or
+# 'name') can be evaluated by iterating over the child elements;
+# cached by xpath string as (prefix, name, tags) or None, where tags
+# caches the namespace-qualified tag name for each namespace uri
+_CHILD_STEP_RE = re.compile(r'^(?:([A-Za-z_][\w.-]*):)?([A-Za-z_][\w.-]*)$')
+_child_steps = {}
+
+
+def _child_step(xpath):
+    try:
+        return _child_steps[xpath]
+    except KeyError:
+        if len(_child_steps) >= _XPATH_CACHE_SIZE:
+            _child_steps.clear()
+        match = _CHILD_STEP_RE.match(xpath)
+        step = None
+        if match:
+            prefix, name = match.groups()
+            step = (prefix, name, {})
+        _child_steps[xpath] = step
+        return step
+
+
+def _evaluate_xpath(xpath, node, context):
+    # evaluate an xpath string on a node, reusing a compiled XPath
+    # when the context only consists of namespaces
+    if len(context) > 1 or (context and 'namespaces' not in context):
+        return node.xpath(xpath, **context)
+    namespaces = context.get('namespaces') or {}
+
+    # simple child element steps: iterate children instead of using xpath
+    step = _child_step(xpath)
+    if step is not None and isinstance(node, etree._Element):
+        prefix, name, tags = step
+        if prefix is None:
+            return list(node.iterchildren(name))
+        if prefix in namespaces:
+            uri = namespaces[prefix]
+            try:
+                tag = tags[uri]
+            except KeyError:
+                tag = tags[uri] = '{%s}%s' % (uri, name)
+            return list(node.iterchildren(tag))
+
+    key = (xpath, frozenset(namespaces.items()))
+    try:
+        compiled = _xpath_cache[key]
+    except KeyError:
+        if len(_xpath_cache) >= _XPATH_CACHE_SIZE:
+            _xpath_cache.clear()
+        compiled = _xpath_cache[key] = etree.XPath(xpath, namespaces=namespaces)
+    return compiled(node)
+
+
 def _find_xml_node(xpath, node, context):
     #In some cases the this will return a value not a node
-    matches = node.xpath(xpath, **context)
+    matches = _evaluate_xpath(xpath, node, context)
     if matches and isinstance(matches, list):
         return matches[0]
     elif matches:
@@ -405,7 +477,7 @@ def _set_in_xml(node, val, context, step):
             node.text = val.text
             for child in val:
                 node.append(child)
-            for name, val in val.attrib.iteritems():
+            for name, val in val.attrib.items():
                 node.set(name, val)
         else: # set node contents to string val
             if not list(node):      # no child elements
@@ -634,7 +706,7 @@ class SingleNodeManager(object):
                 removed = _remove_xml(xast, node, context)
                 # if a node can't be removed, warn since it could have unexpected results
                 if not removed:
-                    logger.warn('''Could not remove xml for '%s' from %r''' % \
+                    logger.warning('''Could not remove xml for '%s' from %r''' % \
                                 (serialize(xast), node))
         else:
             if match is None:
@@ -692,7 +764,7 @@ class NodeList(object):
         # current matches from the xml tree
         # NOTE: retrieving from the xml every time rather than caching
         # because the xml document could change, and we want the latest data
-        return self.node.xpath(self.xpath, **self.context)
+        return _evaluate_xpath(self.xpath, self.node, self.context)
 
     def is_empty(self):
         '''Parallel to :meth:`eulxml.xmlmap.XmlObject.is_empty`.  A
@@ -806,10 +878,36 @@ class NodeList(object):
         del(self[i])
         return val
 
+    def clear(self):
+        "Remove all items from the list."
+        for match in self.matches:
+            match.getparent().remove(match)
+
     def extend(self, list):
         """Extend the list by appending all the items in the given list."""
+        step = _find_terminal_step(self.xast)
+        if step is None or not isinstance(step.node_test, ast.NameTest) \
+                or step.axis not in (None, 'child'):
+            for item in list:
+                self.append(item)
+            return
+
+        # new elements go immediately after the last element in the list;
+        # keep track of it rather than re-evaluating the xpath for each item
+        matches = self.matches
+        last_item = matches[-1] if len(matches) else None
+        is_nodelist = isinstance(self.mapper, NodeMapper)
         for item in list:
-            self.append(item)
+            insert_index = None
+            if last_item is not None:
+                insert_index = last_item.getparent().index(last_item) + 1
+            match = _create_xml_node(self.xast, self.node, self.context, insert_index)
+            if is_nodelist:
+                match.getparent().replace(match, item.node)
+                last_item = item.node
+            else:
+                _set_in_xml(match, self.mapper.to_xml(item), self.context, step)
+                last_item = match
 
     def insert(self, i, x):
         """Insert an item (x) at a given position (i)."""
@@ -192,7 +192,7 @@ class Name(Common):
         # default text display of a name (excluding roles for now)
         # TODO: improve logic for converting to plain-text name
         # (e.g., for template display, setting as dc:creator, etc)
-        return ' '.join([unicode(part) for part in self.name_parts])
+        return ' '.join([six.text_type(part) for part in self.name_parts])
 
 class Genre(Common):
     ROOT_NAME = 'genre'
@@ -25,7 +25,7 @@ class GenerateXmlCatalog(Command):
 
     def run(self):
         from eulxml.catalog import generate_catalog
-        generate_catalog()
+        generate_catalog(force=True)
 
 
 def generate_catalog_if_needed():
@@ -18,6 +18,8 @@
 #!/usr/bin/env python
 
 from __future__ import unicode_literals
+import hashlib
+import json
 import os
 import unittest
 import tempfile
@@ -29,9 +31,11 @@ import glob
 import shutil
 from datetime import date
 import requests
-from eulxml import __version__
+from mock import patch, Mock
+from eulxml import __version__, xmlmap
 from lxml import etree
-from eulxml.catalog import download_schema, generate_catalog, XSD_SCHEMAS
+from eulxml.catalog import download_schema, generate_catalog, resolve, \
+    verify_catalog, XSD_SCHEMAS
 
 
 
@@ -49,8 +53,18 @@ class TestGenerateSchema(unittest.TestCase):
         if os.path.isdir(self.path):
             shutil.rmtree(self.path)
 
-    def test_download_xml_schemas(self):
+    def _session_without_retries(self):
+        # plain requests session, so that tests without network access
+        # fail quickly instead of sleeping through the retry backoff
+        # configured on the shared download session
+        session = requests.Session()
+        self.addCleanup(session.close)
+        return session
+
+    @patch('eulxml.catalog._get_session')
+    def test_download_xml_schemas(self, mocksession):
         """Check if xsd schemas exist and download fresh copies """
+        mocksession.return_value = self._session_without_retries()
         filename = os.path.basename(self.correct_schema)
         schema_path = os.path.join(self.path, filename)
         #do files already exist
@@ -82,8 +96,10 @@ class TestGenerateSchema(unittest.TestCase):
         self.assertEqual(1, len(glob.glob(''.join([self.path, '/*.xsd']))))
 
 
-    def test_generate_xml_catalog(self):
+    @patch('eulxml.catalog._get_session')
+    def test_generate_xml_catalog(self, mocksession):
         """Check if the catalog exists and import xml files into data files """
+        mocksession.return_value = self._session_without_retries()
 
         #check if catalog already exists
         check_catalog = len(glob.glob(''.join([self.path, '/catalog.xml'])))
@@ -112,3 +128,245 @@ class TestGenerateSchema(unittest.TestCase):
         # check how many uris we have in catalog
         self.assertEqual(len(catalog.uri_list), 1)
 
+
+    @patch('eulxml.catalog.download_schema')
+    def test_generate_catalog_order(self, mockdownload):
+        """Catalog entries follow schema order regardless of download order"""
+        schemas = XSD_SCHEMAS[:4]
+        # simulate a failed download for one of the schemas
+        mockdownload.side_effect = lambda uri, path, comment, session: \
+            uri != schemas[1]
+        catalog_file = os.path.join(self.path, 'catalog.xml')
+        catalog = generate_catalog(xsd_schemas=schemas,
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+
+        self.assertEqual(len(schemas), mockdownload.call_count)
+        self.assertEqual([schemas[0], schemas[2], schemas[3]],
+                         [uri.name for uri in catalog.uri_list])
+
+        # unexpected errors are treated as failed downloads
+        def download(uri, path, comment, session):
+            if uri == schemas[2]:
+                raise ValueError('unexpected')
+            return True
+        mockdownload.side_effect = download
+        os.remove(catalog_file)
+        catalog = generate_catalog(xsd_schemas=schemas,
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+        self.assertEqual([schemas[0], schemas[1], schemas[3]],
+                         [uri.name for uri in catalog.uri_list])
+        self.assertTrue(os.path.exists(catalog_file))
+
+    def test_download_schema_not_modified(self):
+        """Unchanged schemas are not downloaded again"""
+        schema_path = os.path.join(self.path, 'test.xsd')
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {'ETag': '"abc"',
+            'Last-Modified': 'Mon, 01 Feb 2016 00:00:00 GMT'}
+        session.get.return_value.iter_content.return_value = [b'<schema/>']
+        self.assertTrue(download_schema(self.correct_schema, schema_path,
+                                        session=session))
+        # no cache headers available for the first download
+        self.assertEqual({}, session.get.call_args[1]['headers'])
+
+        session.get.return_value.status_code = 304
+        session.get.return_value.iter_content.return_value = [b'<changed/>']
+        self.assertTrue(download_schema(self.correct_schema, schema_path,
+                                        session=session))
+        self.assertEqual({'If-None-Match': '"abc"',
+                          'If-Modified-Since': 'Mon, 01 Feb 2016 00:00:00 GMT'},
+                         session.get.call_args[1]['headers'])
+        with open(schema_path, 'rb') as schema_file:
+            self.assertEqual(b'<schema/>', schema_file.read())
+
+        # cache headers are not used when a comment is now requested
+        session.get.return_value.status_code = 200
+        download_schema(self.correct_schema, schema_path, comment=self.comment,
+                        session=session)
+        self.assertEqual({}, session.get.call_args[1]['headers'])
+        # comment is appended after the root element
+        tree = etree.parse(schema_path)
+        self.assertEqual('changed', tree.getroot().tag)
+        self.assertEqual(self.comment, tree.getroot().getnext().text)
+
+    @patch('eulxml.catalog.download_schema')
+    def test_resolve(self, mockdownload):
+        """Schema uris resolve to local copies listed in the catalog"""
+        mockdownload.return_value = True
+        catalog_file = os.path.join(self.path, 'catalog.xml')
+        # not yet in a catalog
+        self.assertEqual(self.correct_schema,
+                         resolve(self.correct_schema, catalog_file))
+
+        generate_catalog(xsd_schemas=[self.correct_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+        schema_path = os.path.join(self.path,
+                                   os.path.basename(self.correct_schema))
+        # in the catalog, but local copy not present
+        self.assertEqual(self.correct_schema,
+                         resolve(self.correct_schema, catalog_file))
+        with open(schema_path, 'w') as schema_file:
+            schema_file.write('<schema/>')
+        self.assertEqual(schema_path,
+                         resolve(self.correct_schema, catalog_file))
+        self.assertEqual(self.wrong_schema,
+                         resolve(self.wrong_schema, catalog_file))
+
+    def test_verify_catalog(self):
+        """Malformed schemas are reported when verifying or validating"""
+        schema_path = os.path.join(self.path, 'test.xsd')
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {}
+        session.get.return_value.iter_content.return_value = [b'<schema>']
+        # not checked by default
+        self.assertTrue(download_schema(self.correct_schema, schema_path,
+                                        session=session))
+        self.assertFalse(download_schema(self.correct_schema, schema_path,
+                                         session=session, validate=True))
+        self.assertEqual([schema_path], verify_catalog(self.path))
+
+        session.get.return_value.iter_content.return_value = [b'<schema/>']
+        self.assertTrue(download_schema(self.correct_schema, schema_path,
+                                        session=session, validate=True))
+        self.assertEqual([], verify_catalog(self.path))
+
+    @patch('eulxml.catalog._get_session')
+    def test_generate_catalog_comment(self, mocksession):
+        """Download comment is added to generated schemas exactly once"""
+        session = mocksession.return_value
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {}
+        session.get.return_value.iter_content.return_value = [b'<schema/>']
+        catalog_file = os.path.join(self.path, 'catalog.xml')
+        generate_catalog(xsd_schemas=[self.correct_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+        schema_path = os.path.join(self.path,
+                                   os.path.basename(self.correct_schema))
+        with open(schema_path, 'rb') as schema_file:
+            content = schema_file.read()
+        self.assertEqual(1, content.count(b'Downloaded by eulxml'))
+
+    def test_download_schema_interrupted(self):
+        """Interrupted downloads leave the existing local copy in place"""
+        schema_path = os.path.join(self.path, 'test.xsd')
+        with open(schema_path, 'wb') as schema_file:
+            schema_file.write(b'<schema/>')
+
+        def interrupted_download(chunk_size):
+            yield b'<sch'
+            raise requests.exceptions.ConnectionError()
+
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.iter_content.side_effect = interrupted_download
+        self.assertFalse(download_schema(self.correct_schema, schema_path,
+                                         session=session))
+        with open(schema_path, 'rb') as schema_file:
+            self.assertEqual(b'<schema/>', schema_file.read())
+        self.assertEqual(['test.xsd'], os.listdir(self.path))
+        # response is closed so the connection can be reused
+        self.assertTrue(session.get.return_value.close.called)
+
+        # content length does not match the content received
+        session.get.return_value.iter_content.side_effect = None
+        session.get.return_value.iter_content.return_value = [b'<sch']
+        session.get.return_value.headers = {'Content-Length': '9'}
+        session.get.return_value.close.reset_mock()
+        self.assertFalse(download_schema(self.correct_schema, schema_path,
+                                         session=session))
+        with open(schema_path, 'rb') as schema_file:
+            self.assertEqual(b'<schema/>', schema_file.read())
+        self.assertEqual(['test.xsd'], os.listdir(self.path))
+        self.assertTrue(session.get.return_value.close.called)
+
+        # connection failures and timeouts are reported, not raised
+        for error in (requests.exceptions.ConnectionError(),
+                      requests.exceptions.Timeout()):
+            session.get.side_effect = error
+            self.assertFalse(download_schema(self.correct_schema, schema_path,
+                                             session=session))
+
+    @patch('eulxml.catalog.download_schema')
+    def test_generate_catalog_current(self, mockdownload):
+        """Existing catalog is reused when all schemas are present and recent"""
+        mockdownload.return_value = True
+        catalog_file = os.path.join(self.path, 'catalog.xml')
+        schema_path = os.path.join(self.path,
+                                   os.path.basename(self.correct_schema))
+        generate_catalog(xsd_schemas=[self.correct_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+        self.assertEqual(1, mockdownload.call_count)
+
+        # local copy of the schema is missing
+        generate_catalog(xsd_schemas=[self.correct_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+        self.assertEqual(2, mockdownload.call_count)
+
+        with open(schema_path, 'w') as schema_file:
+            schema_file.write('<schema/>')
+        catalog = generate_catalog(xsd_schemas=[self.correct_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+        self.assertEqual(2, mockdownload.call_count)
+        self.assertEqual(self.correct_schema, catalog.uri_list[0].name)
+
+        # schema not listed in the catalog
+        generate_catalog(xsd_schemas=[self.correct_schema, self.wrong_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file)
+        self.assertEqual(4, mockdownload.call_count)
+
+        # local copy is too old, or generation is forced
+        generate_catalog(xsd_schemas=[self.correct_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file, max_age=-1)
+        self.assertEqual(5, mockdownload.call_count)
+        generate_catalog(xsd_schemas=[self.correct_schema],
+            xmlcatalog_dir=self.path, xmlcatalog_file=catalog_file, force=True)
+        self.assertEqual(6, mockdownload.call_count)
+
+    def test_download_schema_checksum(self):
+        """Checksums are recorded, and identical schemas are not rewritten"""
+        schema_path = os.path.join(self.path, 'test.xsd')
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {}
+        session.get.return_value.iter_content.return_value = [b'<sch', b'ema/>']
+        download_schema(self.correct_schema, schema_path, session=session)
+        with open(os.path.join(self.path, 'MANIFEST.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(hashlib.sha256(b'<schema/>').hexdigest(),
+                         manifest[self.correct_schema]['sha256'])
+
+        os.utime(schema_path, (0, 0))
+        with patch('eulxml.catalog._replace') as mockreplace:
+            download_schema(self.correct_schema, schema_path, session=session)
+            self.assertNotIn(schema_path,
+                             [args[1] for args, kwargs in mockreplace.call_args_list])
+        # modification time is updated for the unchanged copy
+        self.assertNotEqual(0, os.path.getmtime(schema_path))
+
+    def test_catalog_resolver(self):
+        """Schemas and schema imports are loaded from the local catalog"""
+        base_uri = 'http://example.com/schemas/'
+        schemas = {
+            'a.xsd': '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" ' +
+                'xmlns:b="urn:b" targetNamespace="urn:a">' +
+                '<xs:import namespace="urn:b" schemaLocation="%sb.xsd"/>' % base_uri +
+                '<xs:element name="a" type="b:bType"/></xs:schema>',
+            'b.xsd': '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" ' +
+                'targetNamespace="urn:b"><xs:simpleType name="bType">' +
+                '<xs:restriction base="xs:string"/></xs:simpleType></xs:schema>'
+        }
+        catalog = etree.Element('{urn:oasis:names:tc:entity:xmlns:xml:catalog}catalog')
+        for name, content in schemas.items():
+            with open(os.path.join(self.path, name), 'w') as schema_file:
+                schema_file.write(content)
+            etree.SubElement(catalog, '{urn:oasis:names:tc:entity:xmlns:xml:catalog}uri',
+                             name=base_uri + name, uri=name)
+        catalog_file = os.path.join(self.path, 'catalog.xml')
+        etree.ElementTree(catalog).write(catalog_file)
+
+        with patch('eulxml.XMLCATALOG_FILE', new=catalog_file):
+            schema = xmlmap.loadSchema(base_uri + 'a.xsd')
+        self.assertTrue(schema.validate(etree.fromstring(
+            '<a:a xmlns:a="urn:a">text</a:a>')))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+# file test_eulxml.py
+#
+#   Copyright 2016 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from __future__ import unicode_literals
+import os
+import subprocess
+import sys
+import unittest
+
+import eulxml
+
+
+class PackageTest(unittest.TestCase):
+
+    def test_version(self):
+        self.assertEqual('.'.join(str(i) for i in eulxml.__version_info__[:3]),
+                         eulxml.__version__.split('-')[0])
+
+    def test_import_startup(self):
+        # importing eulxml should not pull in expensive package metadata
+        # modules, which scan sys.path on import or lookup
+        script = 'import sys, eulxml; ' + \
+            'print(",".join(m for m in ("pkg_resources", "importlib.metadata") ' + \
+            'if m in sys.modules))'
+        env = dict(os.environ,
+                   PYTHONPATH=os.path.dirname(os.path.dirname(eulxml.__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script], env=env)
+        self.assertEqual(b'', output.strip())
+
+    @unittest.skipIf(sys.version_info < (3, 7),
+                     'catalog paths are resolved on import before python 3.7')
+    def test_import_catalog_lazy(self):
+        # importing the catalog module should not resolve or register
+        # the local xml catalog until it is used
+        script = 'import eulxml, eulxml.catalog; ' + \
+            'print(eulxml._CATALOG_REGISTERED, eulxml._CATALOG_PATHS)'
+        env = dict(os.environ,
+                   PYTHONPATH=os.path.dirname(os.path.dirname(eulxml.__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script], env=env)
+        self.assertEqual(b'False None', output.strip())
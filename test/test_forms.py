@@ -15,8 +15,10 @@
 #   limitations under the License.
 
 from __future__ import unicode_literals
+import gc
 import re
 import unittest
+import weakref
 from mock import patch
 
 # must be set before importing anything from django
@@ -28,12 +30,14 @@ from django import forms
 from django.conf import settings
 from django.forms import ValidationError
 from django.forms.formsets import BaseFormSet
+from django.utils.safestring import SafeData
 
 from eulxml import xmlmap
 from eulxml.xmlmap.fields import DateTimeField     # not yet supported - testing for errors
 from eulxml.forms import XmlObjectForm, xmlobjectform_factory, SubformField
 from eulxml.forms.xmlobject import XmlObjectFormType, BaseXmlObjectListFieldFormSet, \
-     ListFieldForm, IntegerListFieldForm
+     ListFieldForm, IntegerListFieldForm, formfields_for_xmlobject, \
+     xmlobject_to_dict, _parse_field_list
 
 
 if DJANGO_VERSION >= (1, 7, ):
@@ -227,6 +231,72 @@ class XmlObjectFormTest(unittest.TestCase):
            "initial instance-based form value for 'bool' should be %s, got %s" % \
             (expected, got))
 
+    def test_bound_form_initial_from_instance(self):
+        # initial data for bound forms is only generated from the instance when used
+        with patch('eulxml.forms.xmlobject.xmlobject_to_dict',
+                   wraps=xmlobject_to_dict) as mock_to_dict:
+            form = TestForm(self.post_data, instance=self.testobj)
+            # bound subforms and formset forms also defer initial data
+            form.subforms, form.formsets
+            for formset in form.formsets.values():
+                formset.forms
+            self.assertEqual(0, mock_to_dict.call_count)
+            self.assertTrue(form.has_changed())
+            args, kwargs = mock_to_dict.call_args_list[0]
+            self.assertEqual(self.testobj, args[0])
+            # initial data is only generated once
+            call_count = mock_to_dict.call_count
+            self.assertEqual(13, form['int'].initial)
+            self.assertEqual(call_count, mock_to_dict.call_count)
+
+            # initial data is available as usual when accessed directly
+            form = TestForm(self.post_data, instance=self.testobj,
+                            initial={'extra': 'x'})
+            self.assertEqual(13, form.initial['int'])
+            self.assertEqual('x', form.initial['extra'])
+
+        # only changed fields should be reported
+        self.assert_('int' in form.changed_data)
+        self.assert_('my_opt' in form.changed_data)
+        self.assert_('bool' in form.changed_data)
+        self.assert_('longtext' in form.changed_data)
+
+        data = self.post_data.copy()
+        data.update({'int': 13, 'bool': True})
+        form = TestForm(data, instance=self.testobj)
+        self.assert_('int' not in form.changed_data)
+        self.assert_('bool' not in form.changed_data)
+
+    def test_parse_field_list(self):
+        parsed = _parse_field_list(['id', 'child.val', 'child.id2', 'id',
+                                    'children.val'], include_parents=True)
+        self.assertEqual(['id', 'child', 'children'], list(parsed.fields))
+        self.assertEqual(['val', 'id2'], list(parsed.subfields['child'].fields))
+        self.assertEqual(['val'], list(parsed.subfields['children'].fields))
+
+        parsed = _parse_field_list(['child.val', 'int'])
+        self.assertEqual(['int'], list(parsed.fields))
+        self.assertEqual(['val'], list(parsed.subfields['child'].fields))
+
+    def test_xmlobject_to_dict_fields(self):
+        parsed_fields = _parse_field_list(['int', 'child.val'], include_parents=True)
+        data = xmlobject_to_dict(self.testobj, fields=parsed_fields)
+        self.assertEqual(42, data['child-val'])
+        self.assert_('child-id2' not in data)
+        self.assert_('bool' not in data)
+
+        parsed_exclude = _parse_field_list(['child.id2'])
+        data = xmlobject_to_dict(self.testobj, exclude=parsed_exclude)
+        self.assertEqual(42, data['child-val'])
+        self.assert_('child-id2' not in data)
+        self.assertEqual(True, data['bool'])
+        # subobjects themselves are not included, only their field values
+        self.assert_('child' not in data)
+        self.assert_('children' not in data)
+        # nodelist subobjects are prefixed with their index
+        self.assertEqual(42, data['children-0-val'])
+        self.assertEqual(13, data['children-1-val'])
+
     def test_xmlobjectform_factory(self):
         form = xmlobjectform_factory(TestObject)
         # creates and returns a new form class of type XmlObjectFormType
@@ -252,6 +322,58 @@ class XmlObjectFormTest(unittest.TestCase):
         self.assert_('bool' in form.Meta.exclude)
         self.assert_('id' not in form.Meta.exclude)
 
+    def test_formfields_cached(self):
+        # form classes with the same model and options share generated subforms
+        with patch('eulxml.forms.xmlobject.formfields_for_xmlobject',
+                   wraps=formfields_for_xmlobject) as mockformfields:
+            form1 = xmlobjectform_factory(TestObject, fields=['int', 'child.val'])
+            # called for the form and for the child subform
+            self.assertEqual(2, mockformfields.call_count)
+            form2 = xmlobjectform_factory(TestObject, fields=['int', 'child.val'])
+            self.assertEqual(2, mockformfields.call_count)
+            form3 = xmlobjectform_factory(TestObject, fields=['int', 'child.id2'])
+            self.assertEqual(4, mockformfields.call_count)
+
+        self.assert_(form1.subforms['child'] is form2.subforms['child'])
+        self.assert_(form1.subforms['child'] is not form3.subforms['child'])
+        # each form class gets its own copy of the form fields
+        self.assert_(form1.base_fields['int'] is not form2.base_fields['int'])
+        self.assertEqual(['int'], list(form2.base_fields.keys()))
+
+    def test_subform_classes_cached(self):
+        # models sharing a node class share the generated subform class
+        class OtherObject(xmlmap.XmlObject):
+            ROOT_NAME = 'other'
+            child = xmlmap.NodeField('bar', TestSubobject, verbose_name='Child bar1')
+
+        form = xmlobjectform_factory(OtherObject)
+        self.assert_(form.subforms['child'] is TestForm.subforms['child'])
+        # but not if options differ
+        form = xmlobjectform_factory(OtherObject, fields=['child.val'])
+        self.assert_(form.subforms['child'] is not TestForm.subforms['child'])
+
+    def test_subform_classes_released(self):
+        # cached form classes do not keep dynamically created models alive
+        class Sub(xmlmap.XmlObject):
+            ROOT_NAME = 'sub'
+            val = xmlmap.StringField('@val')
+
+        class Parent(xmlmap.XmlObject):
+            ROOT_NAME = 'parent'
+            sub = xmlmap.NodeField('sub', Sub)
+
+        form = xmlobjectform_factory(Parent)
+        self.assert_(form.subforms['sub'] is xmlobjectform_factory(Parent).subforms['sub'])
+        sub_ref = weakref.ref(Sub)
+        parent_ref = weakref.ref(Parent)
+        del Sub, Parent, form
+        # the subform class is only released once the cached fields for
+        # the parent model are, so collect twice
+        gc.collect()
+        gc.collect()
+        self.assertEqual(None, parent_ref())
+        self.assertEqual(None, sub_ref())
+
     def test_specified_fields(self):
         # if fields are specified, only they should be listed
         myfields = ['int', 'bool', 'child.val']
@@ -411,6 +533,19 @@ class XmlObjectFormTest(unittest.TestCase):
         # children 0 and 2 should be removed from the updated instance
         self.assert_(testobj.children[0] not in instance.children)
         self.assert_(testobj.children[2] not in instance.children)
+        # updating again should not remove anything else
+        num_children = len(instance.children)
+        update_form.update_instance()
+        self.assertEqual(num_children, len(instance.children))
+
+        # subform with a restricted list of fields
+        myform = xmlobjectform_factory(TestObject, fields=['id', 'child.val'])
+        update_form = myform({'id': 'c', 'child-val': 3}, instance=self.testobj)
+        self.assertTrue(update_form.is_valid())
+        instance = update_form.update_instance()
+        self.assertEqual('c', instance.id)
+        self.assertEqual(3, instance.child.val)
+        self.assertEqual(('val', ), update_form.subforms['child']._update_field_names)
 
     def test_unsupported_fields(self):
         # xmlmap fields that XmlObjectForm doesn't know how to convert into form fields
@@ -422,6 +557,46 @@ class XmlObjectFormTest(unittest.TestCase):
 
         self.assertRaises(Exception, xmlobjectform_factory, DateObject)
 
+    def test_field_subclasses(self):
+        # subclasses of supported xmlmap fields use the parent field type
+        class MyStringField(xmlmap.StringField):
+            pass
+
+        class MyObject(xmlmap.XmlObject):
+            ROOT_NAME = 'foo'
+            name = MyStringField('name')
+
+        form = xmlobjectform_factory(MyObject)
+        self.assert_(isinstance(form.base_fields['name'], forms.CharField))
+
+    def test_lazy_subforms(self):
+        # subforms and formsets are only initialized when accessed
+        form = TestForm(instance=self.testobj)
+        self.assert_('subforms' not in form.__dict__)
+        self.assert_('formsets' not in form.__dict__)
+        with patch.object(TestForm, '_init_subforms',
+                          wraps=form._init_subforms) as mock_init:
+            subforms = form.subforms
+            mock_init.assert_called_once_with(None, None)
+            self.assert_(form.subforms is subforms)
+            self.assertEqual(1, mock_init.call_count)
+        self.assert_(isinstance(form.subforms['child'], XmlObjectForm))
+        self.assert_(isinstance(form.formsets['children'], BaseFormSet))
+        # class-level access still returns subform classes
+        self.assert_(issubclass(TestForm.subforms['child'], XmlObjectForm))
+
+        # access before the form is initialized also returns the classes
+        class EarlyAccessForm(TestForm):
+            def __init__(self, *args, **kwargs):
+                self.early = (self.subforms, self.formsets)
+                super(EarlyAccessForm, self).__init__(*args, **kwargs)
+
+        form = EarlyAccessForm(instance=self.testobj)
+        self.assert_(issubclass(form.early[0]['child'], XmlObjectForm))
+        self.assert_(issubclass(form.early[1]['children'], BaseFormSet))
+        self.assert_(isinstance(form.subforms['child'], XmlObjectForm))
+        self.assert_(isinstance(form.formsets['children'], BaseFormSet))
+
     def test_subforms(self):
         # nodefields should be created as subforms on the object
         subform = self.new_form.subforms['child']
@@ -494,6 +669,42 @@ class XmlObjectFormTest(unittest.TestCase):
         self.assertEqual(2, instance.child.val)
         self.assertEqual('two', instance.child.id2)
 
+    def test_html_output(self):
+        html = self.update_form.as_p()
+        # one labeled section for each subform and formset
+        for label in ['Child Bar1', 'Other Child', 'Children', 'Text', 'Numbers']:
+            self.assertEqual(1, html.count('<div class="subform"><p class="label">%s</p>' % label))
+        self.assert_('name="children-TOTAL_FORMS"' in html)
+        self.assert_('name="children-1-val"' in html)
+        self.assert_('name="child-val"' in html)
+        self.assertFalse(html.endswith('\n'))
+
+        html = self.update_form.as_table()
+        self.assertEqual(5, html.count('<tbody><tr><th colspan="2" class="section">'))
+        html = self.update_form.as_ul()
+        self.assertEqual(5, html.count('<li class="subform"><p class="label">'))
+        # html section is passed to subforms rather than set on them
+        self.assert_('_html_section' not in self.update_form.subforms['child'].__dict__)
+
+        # bound formset with no forms
+        form = TestForm(self.post_data, instance=self.testobj)
+        self.assertEqual(0, len(form.formsets['numbers'].forms))
+        html = form.as_p()
+        self.assert_('<div class="subform"><p class="label">Numbers</p></div>' in html)
+
+        # form without any subforms or formsets
+        class SimpleForm(XmlObjectForm):
+            class Meta:
+                model = TestObject
+                fields = ['id', 'bool']
+        form = SimpleForm(instance=self.testobj)
+        self.assertEqual({}, form.subforms)
+        self.assertEqual({}, form.formsets)
+        html = form.as_p()
+        self.assert_('name="id"' in html)
+        self.assertFalse('class="subform"' in html)
+        self.assert_(isinstance(html, SafeData))
+
     def test_formsets(self):
         # nodelistfields should be created as formsets on the object
         formset = self.new_form.formsets['children']
@@ -542,6 +753,12 @@ class XmlObjectFormTest(unittest.TestCase):
 
         # initialize with an instance and verify initial values
         formset = self.update_form.formsets['children']
+        # one initial form per instance
+        self.assertEqual(2, formset.initial_form_count())
+        # formset initial data is generated from the instances
+        self.assertEqual(2, len(formset.initial))
+        self.assertEqual([xmlobject_to_dict(child) for child in self.testobj.children],
+                         list(formset.initial))
         self.assertEqual('forty-two', formset.forms[0].initial['id2'])
         self.assertEqual(42, formset.forms[0].initial['val'])
         self.assertEqual(None, formset.forms[1].initial['id2'])
@@ -657,8 +874,15 @@ class XmlObjectFormTest(unittest.TestCase):
             mockloadschema.side_effect = Exception
             # set a test XSD so xmlobject will attempt to load it
             self.testobj.XSD_SCHEMA = 'foo'
-            # exception should be raised on init, not validation
-            self.assertRaises(Exception, TestForm,
+            # by default, exception should be raised on validation, not init
+            form = TestForm(self.post_data, instance=self.testobj)
+            self.assertEqual(0, mockloadschema.call_count)
+            self.assertRaises(Exception, form.is_valid)
+
+            # with eager schema loading, exception should be raised on init
+            class EagerForm(TestForm):
+                eager_schema_load = True
+            self.assertRaises(Exception, EagerForm,
                               self.post_data, instance=self.testobj)
 
 
@@ -17,6 +17,7 @@
 #!/usr/bin/env python
 
 import email
+from io import BytesIO
 import unittest
 import os
 
@@ -61,6 +62,102 @@ class TestCerp(unittest.TestCase):
 
         self.assertEqual(self.message.eol, 'LF')
 
+        self.assertEqual('<Message %s>' % self.message.message_id, repr(self.message))
+        msg = cerp.Message()
+        self.assertEqual('<Message (no id)>', repr(msg))
+        msg.local_id = 5
+        self.assertEqual('<Message 5>', repr(msg))
+        msg.message_id = ''
+        self.assertEqual('<Message 5>', repr(msg))
+        msg.message_id = '<1@example.com>'
+        self.assertEqual('<Message <1@example.com>>', repr(msg))
+
+    def test_folder_all_hashes(self):
+        self.assertEqual([], self.folder.all_hashes())
+
+        folder = cerp.Folder()
+        msg = cerp.Message()
+        msg.create_hash()
+        msg.hash.function = 'MD5'
+        msg.hash.value = 'abc'
+        msg.create_single_body()
+        msg.single_body.create_ext_body_content()
+        msg.single_body.ext_body_content.create_hash()
+        msg.single_body.ext_body_content.hash.value = 'def'
+        folder.messages.append(msg)
+        hashes = folder.all_hashes()
+        self.assertEqual(2, len(hashes))
+        self.assert_(isinstance(hashes[0], cerp.Hash))
+        self.assertEqual(('MD5', 'abc'), (hashes[0].function, hashes[0].value))
+        self.assertEqual('def', hashes[1].value)
+
+    def test_folder_all_messages(self):
+        messages = self.folder.all_messages()
+        self.assertEqual(1, len(messages))
+        self.assert_(isinstance(messages[0], cerp.Message))
+        self.assertEqual(self.message.local_id, messages[0].local_id)
+
+        folder = cerp.Folder()
+        for i in range(2):
+            msg = cerp.Message(local_id=i)
+            # child messages in a message body are not included
+            msg.create_single_body()
+            msg.single_body.create_child_message()
+            folder.messages.append(msg)
+        subfolder = cerp.Folder()
+        subfolder.messages.append(cerp.Message(local_id=2))
+        folder.subfolders.append(subfolder)
+        folder.subfolders[0].subfolders.append(cerp.Folder())
+        folder.subfolders[0].subfolders[0].messages.append(cerp.Message(local_id=3))
+        self.assertEqual([0, 1, 2, 3],
+                         [msg.local_id for msg in folder.all_messages()])
+
+    def test_folder_to_columns(self):
+        columns = self.folder.to_columns()
+        self.assertEqual(set(['orig_date_list', 'from_list', 'to_list', 'subject_list']),
+                         set(columns))
+        for name, values in columns.items():
+            self.assertEqual([list(getattr(msg, name)) for msg in self.folder.messages],
+                             values)
+
+        folder = cerp.Folder()
+        for recipients in (['a@example.com', 'b@example.com'], []):
+            msg = cerp.Message()
+            msg.to_list.extend(recipients)
+            # nested message headers are not included
+            msg.create_single_body()
+            msg.single_body.create_child_message()
+            msg.single_body.child_message.to_list.append('c@example.com')
+            folder.messages.append(msg)
+        columns = folder.to_columns(fields=['to_list', 'cc_list'])
+        self.assertEqual([['a@example.com', 'b@example.com'], []], columns['to_list'])
+        self.assertEqual([[], []], columns['cc_list'])
+
+        self.assertRaises(ValueError, folder.to_columns, fields=['local_id'])
+        self.assertRaises(ValueError, folder.to_columns, fields=['bogus'])
+
+    def test_body_content(self):
+        body = cerp.SingleBody()
+        self.assertEqual(None, body.content)
+        body.create_child_message()
+        self.assert_(isinstance(body.content, cerp.ChildMessage))
+        # body content is preferred, regardless of document order
+        body.create_body_content()
+        self.assert_(isinstance(body.content, cerp.BodyContent))
+        self.assertEqual(body.body_content, body.content)
+
+        multi = cerp.MultiBody()
+        self.assertEqual(None, multi.body)
+        multi.create_multi_body()
+        self.assert_(isinstance(multi.body, cerp.MultiBody))
+        multi.create_single_body()
+        self.assert_(isinstance(multi.body, cerp.SingleBody))
+
+        message = cerp.Message()
+        self.assertEqual(None, message.body)
+        message.create_multi_body()
+        self.assert_(isinstance(message.body, cerp.MultiBody))
+
     # simple email text fixture from RFC822 Appendix A
     simple_email_content = '''This is a message just to say hello.
 So, "Hello".'''
@@ -74,6 +171,28 @@ Content-Type: text/plain; charset=us-ascii
 
 %s''' % simple_email_content
 
+    def test_message_iter_from_file(self):
+        message_ids = [msg.message_id for msg in self.folder.messages]
+        messages = cerp.Message.iter_from_file(self.FIXTURE_FILE)
+        msg = next(messages)
+        self.assert_(isinstance(msg, cerp.Message))
+        self.assertEqual(self.message.local_id, msg.local_id)
+        self.assertEqual(self.message.subject_list, msg.subject_list)
+        self.assertEqual(message_ids,
+                         [msg.message_id] + [m.message_id for m in messages])
+
+        xml = ('<Account xmlns="%s"><Folder><Name>In</Name>' % cerp.Message.ROOT_NS +
+               ''.join('<Message><LocalId>%d</LocalId></Message>' % i for i in range(3)) +
+               '</Folder></Account>').encode('utf-8')
+        local_ids = []
+        for msg in cerp.Message.iter_from_file(BytesIO(xml)):
+            local_ids.append(msg.local_id)
+            folder = msg.node.getparent()
+        self.assertEqual([0, 1, 2], local_ids)
+        # previously processed content is removed from the document
+        self.assertEqual(1, len(folder))
+        self.assertEqual(0, len(folder[0]))
+
     def test_message_from_email(self):
         email_msg = email.message_from_string(self.simple_email)
         cerp_msg = cerp.Message.from_email_message(email_msg)
@@ -84,5 +203,28 @@ Content-Type: text/plain; charset=us-ascii
         self.assertEqual(email_msg['Subject'], cerp_msg.subject_list[0])
         self.assertEqual(email_msg['Message-Id'], cerp_msg.message_id)
         self.assertEqual(self.simple_email_content, cerp_msg.body.content.content)
+        self.assertEqual(None, cerp_msg.local_id)
+        self.assertTrue(cerp_msg.message_id_supplied)
+
+        cerp_msg = cerp.Message.from_email_message(email_msg, local_id=3)
+        self.assertEqual(3, cerp_msg.local_id)
+
+        # control characters not allowed in xml are removed from the body
+        email_msg = email.message_from_string(self.simple_email.replace(
+            'just to', 'just\x00 to\x1b\tand'))
+        cerp_msg = cerp.Message.from_email_message(email_msg)
+        self.assertEqual(self.simple_email_content.replace('just to', 'just to\tand'),
+                         cerp_msg.body.content.content)
+
+        # sender is populated from the Sender header, not From;
+        # repeated headers are all included, regardless of case
+        email_msg = email.message_from_string(
+            'Sender: list@example.net\nCC: a@example.net\ncc: b@example.net\n' +
+            self.simple_email)
+        cerp_msg = cerp.Message.from_email_message(email_msg)
+        self.assertEqual(['list@example.net'], cerp_msg.sender_list)
+        self.assertEqual(['a@example.net', 'b@example.net'], cerp_msg.cc_list)
+        self.assertEqual(len(email_msg.items()), len(cerp_msg.headers))
+        self.assertEqual('Sender', cerp_msg.headers[0].name)
 
         # TODO: multiple recipients, attachments, etc.
@@ -85,6 +85,11 @@ class TestFields(unittest.TestCase):
         # test set
         obj.child = TestSubobject(val='144')
         self.assertEqual(obj.child.val, '144')
+        # attributes are copied when setting a node
+        class AttrSubobject(TestSubobject):
+            id = xmlmap.StringField('@id')
+        obj.child = AttrSubobject(val='12', id='b')
+        self.assertEqual(obj.node.xpath('string(bar[1]/@id)'), 'b')
 
         # check required
         self.assertTrue(obj._fields['child'].required)
@@ -148,6 +153,9 @@ class TestFields(unittest.TestCase):
         obj = TestObject(self.fixture)
         self.assertEqual(obj.val, '42')
         self.assertEqual(obj.missing, None)
+        self.assertEqual(obj.empty, '')
+        # string value of an element with children includes descendant text
+        self.assertEqual(obj.mixed.strip(), '42')
         # undefined if >1 matched nodes
 
         # access normalized and non-normalized versions of string field
@@ -633,6 +641,62 @@ class TestFields(unittest.TestCase):
         del obj.nested_pred
         self.assertEqual(0, obj.node.xpath('count(foo)'))
 
+    def test_compiled_xpath_cache(self):
+        from eulxml.xmlmap import fields
+        class TestObject(xmlmap.XmlObject):
+            ROOT_NAMESPACES = {'ex': 'http://example.com/'}
+            ex_bar = xmlmap.StringField('ex:bar[text()]')
+            bars = xmlmap.StringListField('ex:bar[text()]')
+
+        fields._xpath_cache.clear()
+        obj = TestObject(xmlmap.parseString(
+            '<foo xmlns:ex="http://example.com/"><ex:bar>a</ex:bar><ex:bar>b</ex:bar></foo>'))
+        self.assertEqual('a', obj.ex_bar)
+        self.assertEqual(['a', 'b'], obj.bars)
+        # same xpath and namespaces share a single compiled xpath
+        self.assertEqual(1, len(fields._xpath_cache))
+        self.assertEqual('a', obj.ex_bar)
+        self.assertEqual(1, len(fields._xpath_cache))
+
+        # a different namespace for the same prefix is compiled separately
+        class OtherObject(TestObject):
+            ROOT_NAMESPACES = {'ex': 'urn:other'}
+        other = OtherObject(xmlmap.parseString(
+            '<foo xmlns:ex="urn:other"><ex:bar>c</ex:bar></foo>'))
+        self.assertEqual('c', other.ex_bar)
+        self.assertEqual('a', obj.ex_bar)
+        self.assertEqual(2, len(fields._xpath_cache))
+
+    def test_child_step_xpath(self):
+        from eulxml.xmlmap import fields
+        class TestObject(xmlmap.XmlObject):
+            ROOT_NAMESPACES = {'ex': 'http://example.com/'}
+            bar = xmlmap.StringField('bar')
+            ex_bar = xmlmap.StringField('ex:bar')
+            ex_bars = xmlmap.StringListField('ex:bar')
+            missing = xmlmap.StringField('ex:missing')
+
+        fields._xpath_cache.clear()
+        obj = TestObject(xmlmap.parseString('<foo xmlns:ex="http://example.com/">' +
+            '<ex:baz><ex:bar>nested</ex:bar></ex:baz><!-- bar -->' +
+            '<bar>plain</bar><ex:bar>a</ex:bar><ex:bar>b</ex:bar></foo>'))
+        # only direct children with the matching namespace are selected
+        self.assertEqual('plain', obj.bar)
+        self.assertEqual('a', obj.ex_bar)
+        self.assertEqual(['a', 'b'], obj.ex_bars)
+        self.assertEqual(None, obj.missing)
+        # simple child steps are evaluated without compiling an xpath
+        self.assertEqual(0, len(fields._xpath_cache))
+        # namespace-qualified tag name is only generated once
+        self.assertEqual({'http://example.com/': '{http://example.com/}bar'},
+                         fields._child_steps['ex:bar'][2])
+
+        # setting creates the node as usual
+        obj.missing = 'here'
+        self.assertEqual('here', obj.missing)
+        self.assertEqual('here', obj.node.xpath('string(ex:missing)',
+                                                namespaces=TestObject.ROOT_NAMESPACES))
+
 
 # tests for settable listfields
 class SubList(xmlmap.XmlObject):
@@ -946,6 +1010,17 @@ class TestNodeList(unittest.TestCase):
         self.assertEqual('007', node.id, "popped node has expected id")
         self.assertEqual(['side-a', 'side-b'], node.parts, "popped node has expected parts")
 
+    def test_clear(self):
+        self.obj.letters.clear()
+        self.assertEqual([], self.obj.letters)
+        self.assertEqual(0, len(self.obj.letters))
+        # clearing an empty list is fine
+        self.obj.empty.clear()
+        self.assertEqual([], self.obj.empty)
+
+        self.obj.nodes.clear()
+        self.assertEqual(0, len(self.obj.nodes))
+
     def test_extend(self):
         letters = self.obj.letters
         letters.extend(['w', 'd', '40'])
@@ -953,6 +1028,11 @@ class TestNodeList(unittest.TestCase):
         self.assert_('d' in letters, 'value in extend list is now in StringList')
         self.assertEqual('40', letters[len(letters) - 1],
             'last value in extend list is now last element StringList')
+        # new values are added in order, immediately after the last existing value
+        self.assertEqual(['y', 'w', 'd', '40'], letters.data[-4:])
+        l_nodes = self.obj.node.xpath('l')
+        self.assertEqual(l_nodes[-1].getprevious(), l_nodes[-2])
+        self.assertEqual('sub', l_nodes[-1].getnext().tag)
 
         # extend an empty list
         new_list = ['a', 'b', 'c']